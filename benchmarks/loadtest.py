@@ -0,0 +1,179 @@
+"""Drive the app with concurrent simulated visitors and report latency.
+
+Each simulated visitor is a thread with its own test client.  It picks
+requests from MIX: anonymous page views, leaderboard reads, logins through
+a stubbed Reddit OAuth flow and bracket submissions.  Visitors must log in
+before they submit.  Anonymous pages go through the page cache as
+configured.  The database is a seeded SQLite file built the same
+way as benchmarks/run.py, so the configured database is never touched.
+
+Run it with 'python manager.py loadtest'.
+"""
+import json
+import math
+import random
+from threading import Thread
+from time import time
+from urlparse import urlparse, parse_qs
+from cbbpoll import app, db, views, cache
+from run import configure, bench_results
+from seed import seed
+
+MIX = [
+    ('index', 40),
+    ('teams', 10),
+    ('leaderboard', 25),
+    ('login', 10),
+    ('submit_bracket', 15),
+]
+
+
+class StubReddit(object):
+    """Enough of praw.Reddit for the login views; the OAuth code is the username."""
+
+    def __init__(self, **kwargs):
+        self.auth = self._Auth()
+        self.user = self._User(self.auth)
+
+    class _Auth(object):
+        name = None
+
+        def url(self, scopes, state, duration='permanent'):
+            return 'https://www.reddit.com/api/v1/authorize?state=%s' % state
+
+        def authorize(self, code):
+            self.name = code
+            return 'token-%s' % code
+
+    class _User(object):
+        def __init__(self, auth):
+            self.auth = auth
+
+        def me(self):
+            return self._Redditor(self.auth.name)
+
+        class _Redditor(object):
+            def __init__(self, name):
+                self.name = name
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of sorted samples."""
+    if not samples:
+        return None
+    return samples[max(int(math.ceil(p / 100.0 * len(samples))) - 1, 0)]
+
+
+class Visitor(Thread):
+    def __init__(self, number, deadline, tournaments, users, rnd):
+        Thread.__init__(self)
+        self.daemon = True
+        self.number = number
+        self.deadline = deadline
+        self.tournaments = tournaments
+        self.users = users
+        self.rnd = rnd
+        self.client = app.test_client()
+        self.logged_in = False
+        self.samples = []
+
+    def run(self):
+        routes = [route for route, weight in MIX for _ in range(weight)]
+        while time() < self.deadline:
+            route = self.rnd.choice(routes)
+            if route == 'submit_bracket' and not self.logged_in:
+                route = 'login'
+            started = time()
+            try:
+                ok = getattr(self, route)()
+            except Exception:
+                app.logger.exception('Load test request to %s failed', route)
+                ok = False
+            self.samples.append((route, (time() - started) * 1000, ok))
+
+    def index(self):
+        return self.client.get('/').status_code == 200
+
+    def teams(self):
+        return self.client.get('/teams').status_code == 200
+
+    def leaderboard(self):
+        tournament = self.rnd.choice(self.tournaments[1:])
+        return self.client.get('/leaderboard/%d/' % tournament.conference_id).status_code == 200
+
+    def login(self):
+        nickname = 'user%d' % self.rnd.randint(2, self.users)
+        response = self.client.get('/login')
+        state = parse_qs(urlparse(response.headers['Location']).query)['state'][0]
+        response = self.client.get('/authorize_callback?state=%s&code=%s' % (state, nickname))
+        self.logged_in = response.status_code == 302
+        return self.logged_in
+
+    def submit_bracket(self):
+        tournament = self.tournaments[0]
+        picks = dict((str(game), team) for game, team in tournament.random_picks(self.rnd).items())
+        response = self.client.post('/api/bracket/%d' % tournament.conference_id,
+                                    data=json.dumps(dict(picks=picks)), content_type='application/json')
+        return response.status_code == 200
+
+
+def report(samples, elapsed):
+    by_route = {}
+    for route, ms, ok in samples:
+        by_route.setdefault(route, []).append((ms, ok))
+    routes = {}
+    for route, rows in by_route.items():
+        latencies = sorted(ms for ms, _ in rows)
+        routes[route] = dict(requests=len(rows),
+                             errors=sum(1 for _, ok in rows if not ok),
+                             per_second=round(len(rows) / elapsed, 1),
+                             p50_ms=round(percentile(latencies, 50), 1),
+                             p95_ms=round(percentile(latencies, 95), 1),
+                             p99_ms=round(percentile(latencies, 99), 1),
+                             max_ms=round(latencies[-1], 1))
+    return dict(seconds=round(elapsed, 1),
+                requests=len(samples),
+                per_second=round(len(samples) / elapsed, 1),
+                errors=sum(1 for _, _, ok in samples if not ok),
+                routes=routes)
+
+
+def print_report(result):
+    print('%-16s %8s %7s %8s %8s %8s %8s %8s' % ('route', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms',
+                                                 'p99 ms', 'max ms'))
+    for route, row in sorted(result['routes'].items()):
+        print('%-16s %8d %7d %8.1f %8.1f %8.1f %8.1f %8.1f' % (
+            route, row['requests'], row['errors'], row['per_second'], row['p50_ms'], row['p95_ms'],
+            row['p99_ms'], row['max_ms']))
+    print('%d requests in %.1fs: %.1f req/s, %d errors' % (
+        result['requests'], result['seconds'], result['per_second'], result['errors']))
+
+
+def main(clients=10, duration=30, users=1000, conferences=4, teams=16, seed_value=0, db_path=None, output=None):
+    page_cache = app.config.get('PAGE_CACHE', 'memory')
+    configure(db_path)
+    # Serve anonymous pages the way the configured site would.
+    app.config['PAGE_CACHE'] = page_cache
+    cache._store[0] = None
+    rnd = random.Random(seed_value)
+    tournaments = seed(users, conferences, teams, seed_value)
+    bench_results(tournaments[1:], rnd)
+    db.session.remove()
+
+    views.Reddit = StubReddit
+    views.update_flair = lambda user_id, nickname: None
+    deadline = time() + duration
+    visitors = [Visitor(i, deadline, tournaments, users, random.Random(rnd.random())) for i in range(clients)]
+    started = time()
+    for visitor in visitors:
+        visitor.start()
+    for visitor in visitors:
+        visitor.join()
+    result = report([sample for visitor in visitors for sample in visitor.samples], time() - started)
+    result['parameters'] = dict(clients=clients, duration=duration, users=users, conferences=conferences,
+                                teams=teams, seed=seed_value)
+    print_report(result)
+    if output:
+        with open(output, 'w') as f:
+            f.write(json.dumps(result, sort_keys=True, indent=2, separators=(',', ': ')) + '\n')
+    return result
@@ -0,0 +1,73 @@
+"""Time rendering a reminder campaign per recipient versus once per campaign.
+
+Run from the repository root, with config.py in place:
+
+    python benchmarks/render.py [recipients]
+
+Each variant runs in a forked child so its peak memory is measured on its
+own.  Prints one JSON object per template.
+"""
+import json
+import os
+import resource
+import sys
+from collections import namedtuple
+from time import time
+
+sys.path.insert(0, os.getcwd())
+
+from flask import render_template
+from cbbpoll import app
+from cbbpoll.message import CampaignTemplate
+
+Recipient = namedtuple('Recipient', 'id nickname email')
+Tournament = namedtuple('Tournament', 'id name')
+
+TEMPLATES = ['email_remind_open.txt', 'email_remind_close.txt', 'pm_remind_open.md', 'pm_remind_close.md']
+
+
+def per_recipient(template, users, **kwargs):
+    return [render_template(template, user=user, **kwargs) for user in users]
+
+
+def per_campaign(template, users, **kwargs):
+    body = CampaignTemplate(template, **kwargs)
+    return [body.render(user) for user in users]
+
+
+def measure(render, template, users, **kwargs):
+    """Seconds taken and peak RSS growth in KiB, measured in a child process."""
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read)
+        with app.test_request_context():
+            render_template(template, user=users[0], **kwargs)
+            baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            started = time()
+            bodies = render(template, users, **kwargs)
+            elapsed = time() - started
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        os.write(write, json.dumps([elapsed, peak - baseline, sum(len(b) for b in bodies)]))
+        os._exit(0)
+    os.close(write)
+    result = os.read(read, 4096)
+    os.waitpid(pid, 0)
+    elapsed, rss, size = json.loads(result)
+    return dict(seconds=round(elapsed, 3), per_second=int(len(users) / max(elapsed, 1e-6)),
+                peak_rss_kib=rss, output_bytes=size)
+
+
+def main(count=50000):
+    users = [Recipient(i, 'user%d' % i, 'user%d@example.com' % i) for i in range(1, count + 1)]
+    conference = Tournament(1, 'Benchmark')
+    for template in TEMPLATES:
+        before = measure(per_recipient, template, users, conference=conference)
+        after = measure(per_campaign, template, users, conference=conference)
+        print(json.dumps(dict(template=template, recipients=count, per_recipient=before, per_campaign=after,
+                              speedup=round(before['seconds'] / max(after['seconds'], 1e-6), 1)),
+                         sort_keys=True))
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,177 @@
+"""Time the app's hot paths against a seeded SQLite database.
+
+Run from the repository root, with config.py in place:
+
+    python benchmarks/run.py --users 5000 --conferences 8 --output bench.json
+
+The database named by --db is rebuilt from scratch on every run, so with
+the same arguments every run sees the same rows.  The results are written
+as JSON with sorted keys, ready to diff against another release.
+
+Tournament 1 is kept unplayed for bracket submissions.  Results are
+entered for the first round of every other tournament, then the
+leaderboards, user listings and reminder fan-out are timed.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+from time import time
+
+sys.path.insert(0, os.getcwd())
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy
+import sqlalchemy
+from cbbpoll import app, db, cache, usercache
+
+
+def configure(path):
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.abspath(path),
+                      SQLALCHEMY_POOL_SIZE=None, SQLALCHEMY_POOL_TIMEOUT=None, SQLALCHEMY_MAX_OVERFLOW=None,
+                      DEBUG=False, TESTING=True, WTF_CSRF_ENABLED=False,
+                      JOBS_INLINE=True, JOB_WORKERS=0, PAGE_CACHE=None)
+    cache._store[0] = None
+    usercache._store[0] = None
+    app.extensions['mail'].suppress = True
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    n = len(samples)
+    return dict(runs=n,
+                min_ms=round(samples[0], 2),
+                median_ms=round(samples[n // 2], 2),
+                mean_ms=round(sum(samples) / n, 2),
+                max_ms=round(samples[-1], 2))
+
+
+def timed(f, repeat=1):
+    samples = []
+    for _ in range(repeat):
+        started = time()
+        f()
+        samples.append((time() - started) * 1000)
+    return summarize(samples)
+
+
+def client_for(user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = unicode(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def get(client, url):
+    def fetch():
+        response = client.get(url)
+        assert response.status_code == 200, (url, response.status_code)
+    return fetch
+
+
+def bench_submission(tournament, users, repeat, rnd):
+    samples = []
+    for i in range(repeat):
+        user_id = 2 + i % max(users - 1, 1)
+        picks = dict((str(game), team) for game, team in tournament.random_picks(rnd).items())
+        client = client_for(user_id)
+        started = time()
+        response = client.post('/api/bracket/%d' % tournament.conference_id, data=json.dumps(dict(picks=picks)),
+                               content_type='application/json')
+        samples.append((time() - started) * 1000)
+        assert response.status_code == 200, response.data
+    return summarize(samples)
+
+
+def bench_results(tournaments, rnd):
+    """Enter first round results through the ORM so the scoring hooks run."""
+    from cbbpoll.models import Result
+    samples = []
+    for tournament in tournaments:
+        for game_id, _, _, home, away in tournament.first_round:
+            started = time()
+            db.session.add(Result(game_id=game_id, winning_team_id=rnd.choice((home, away))))
+            db.session.commit()
+            samples.append((time() - started) * 1000)
+    return summarize(samples)
+
+
+def bench_reminders(conference_id):
+    from cbbpoll.models import Conference
+    from cbbpoll.message import send_reminder_emails, send_reminder_pms
+    conference = Conference.query.get(conference_id)
+    results = {}
+    with app.test_request_context():
+        results['reminder_emails'] = timed(lambda: send_reminder_emails('Benchmark', 'email_remind_open',
+                                                                        conference=conference))
+        # PMs are only queued, as they would be for the job workers.
+        app.config['JOBS_INLINE'] = False
+        try:
+            results['reminder_pms'] = timed(lambda: send_reminder_pms('Benchmark', 'pm_remind_open',
+                                                                      conference=conference))
+        finally:
+            app.config['JOBS_INLINE'] = True
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--conferences', type=int, default=4)
+    parser.add_argument('--teams', type=int, default=16, help='field size of each tournament, a power of two')
+    parser.add_argument('--repeat', type=int, default=20, help='runs of each timed request')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', default=os.path.join(tempfile.gettempdir(), 'cbbpoll-benchmark.db'))
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    args = parser.parse_args()
+    if args.conferences < 2:
+        parser.error('--conferences must be at least 2')
+
+    configure(args.db)
+    from seed import seed
+    from cbbpoll.models import score_conference, Prediction
+    rnd = random.Random(args.seed)
+    results = {}
+
+    started = time()
+    tournaments = seed(args.users, args.conferences, args.teams, args.seed)
+    results['seed'] = summarize([(time() - started) * 1000])
+    played = tournaments[1:]
+    results['score_all_conferences'] = timed(lambda: [score_conference(t.conference_id) for t in tournaments])
+    results['submit_bracket'] = bench_submission(tournaments[0], args.users, args.repeat, rnd)
+    results['score_result'] = bench_results(played, rnd)
+    results['rescore_conference'] = timed(lambda: score_conference(played[0].conference_id), args.repeat)
+
+    admin = client_for(1)
+    anonymous = app.test_client()
+    leaderboard = '/leaderboard/%d/' % played[0].conference_id
+    results['index_anonymous'] = timed(get(anonymous, '/'), args.repeat)
+    results['teams_anonymous'] = timed(get(anonymous, '/teams'), args.repeat)
+    results['leaderboard'] = timed(get(anonymous, leaderboard), args.repeat)
+    results['leaderboard_page_2'] = timed(get(anonymous, leaderboard + '2/'), args.repeat) \
+        if args.users > 50 else None
+    results['users'] = timed(get(admin, '/users'), args.repeat)
+    results['users_json'] = timed(get(admin, '/_users?conference=Conference+2&limit=100'), args.repeat)
+    results.update(bench_reminders(played[0].conference_id))
+
+    output = dict(
+        parameters=vars(args),
+        rows=dict(predictions=Prediction.query.count(), games=sum(len(t.games) for t in tournaments)),
+        versions=dict(python=platform.python_version(), sqlalchemy=sqlalchemy.__version__, numpy=numpy.__version__),
+        results=dict((name, value) for name, value in results.items() if value is not None))
+    text = json.dumps(output, sort_keys=True, indent=2, separators=(',', ': '))
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""Fill an empty database with synthetic tournaments, users and brackets.
+
+Everything comes from one random.Random(seed), so the same arguments
+always produce the same rows.  Rows are written with Core executemany
+inserts and explicit ids; none of the model commit hooks run.
+"""
+import random
+from cbbpoll import db
+from cbbpoll.models import User, Team, Conference, Game, Prediction
+
+CHUNK = 10000
+
+
+class Tournament(object):
+    """The shape of one seeded conference tournament."""
+
+    def __init__(self, conference_id):
+        self.conference_id = conference_id
+        self.team_ids = []
+        # (game id, home feeder game id, away feeder game id, home team, away team),
+        # each game after the games feeding it
+        self.games = []
+
+    @property
+    def first_round(self):
+        return [game for game in self.games if game[1] is None]
+
+    def random_picks(self, rnd):
+        """A consistent bracket: each pick is one of the two teams that could play."""
+        picks = {}
+        for game_id, home_feeder, away_feeder, home_team, away_team in self.games:
+            home = picks[home_feeder] if home_feeder else home_team
+            away = picks[away_feeder] if away_feeder else away_team
+            picks[game_id] = rnd.choice((home, away))
+        return picks
+
+
+def _insert(table, rows):
+    for start in range(0, len(rows), CHUNK):
+        db.engine.execute(table.insert(), rows[start:start + CHUNK])
+
+
+def seed(users=1000, conferences=4, teams=16, seed=0):
+    """Recreate every table and seed it; returns the list of Tournaments.
+
+    teams is the field size of each tournament and must be a power of two.
+    Every user gets a full bracket in every tournament.  No results are
+    entered and no scores are computed.
+    """
+    if teams < 2 or teams & (teams - 1):
+        raise ValueError('teams must be a power of two')
+    rnd = random.Random(seed)
+    db.drop_all()
+    db.create_all()
+
+    conference_rows, team_rows, game_rows = [], [], []
+    tournaments = []
+    team_id = game_id = 0
+    for conference_id in range(1, conferences + 1):
+        name = 'Conference %d' % conference_id
+        conference_rows.append(dict(id=conference_id, name=name, year=2019, status='In Progress'))
+        tournament = Tournament(conference_id)
+        for _ in range(teams):
+            team_id += 1
+            tournament.team_ids.append(team_id)
+            team_rows.append(dict(id=team_id, full_name='University %d' % team_id, short_name='U%d' % team_id,
+                                  flair='team-%d' % team_id, nickname='Team %d' % team_id,
+                                  png_name='team%d' % team_id, conference=name))
+        level = []
+        for home, away in zip(tournament.team_ids[0::2], tournament.team_ids[1::2]):
+            game_id += 1
+            game_rows.append(dict(id=game_id, conference_id=conference_id, point_value=1,
+                                  home_team_id=home, away_team_id=away, is_championship=False))
+            tournament.games.append((game_id, None, None, home, away))
+            level.append(game_rows[-1])
+        value = 1
+        while len(level) > 1:
+            value *= 2
+            next_level = []
+            for home, away in zip(level[0::2], level[1::2]):
+                game_id += 1
+                home.update(next_game_id=game_id, winner_is_home=True)
+                away.update(next_game_id=game_id, winner_is_home=False)
+                game_rows.append(dict(id=game_id, conference_id=conference_id, point_value=value,
+                                      is_championship=False))
+                tournament.games.append((game_id, home['id'], away['id'], None, None))
+                next_level.append(game_rows[-1])
+            level = next_level
+        level[0]['is_championship'] = True
+        tournaments.append(tournament)
+    for row in game_rows:
+        row.setdefault('next_game_id', None)
+        row.setdefault('winner_is_home', None)
+        row.setdefault('home_team_id', None)
+        row.setdefault('away_team_id', None)
+
+    all_team_ids = [row['id'] for row in team_rows]
+    user_rows = []
+    for user_id in range(1, users + 1):
+        user_rows.append(dict(id=user_id, nickname='user%d' % user_id, email='user%d@example.com' % user_id,
+                              emailConfirmed=True, role='a' if user_id == 1 else 'u',
+                              emailReminders=rnd.random() < 0.5, pmReminders=rnd.random() < 0.3,
+                              applicationFlag=rnd.random() < 0.1,
+                              flair=rnd.choice(all_team_ids) if rnd.random() < 0.9 else None))
+
+    _insert(Conference.__table__, conference_rows)
+    _insert(Team.__table__, team_rows)
+    _insert(Game.__table__, game_rows)
+    _insert(User.__table__, user_rows)
+    predictions = []
+    for tournament in tournaments:
+        for user_id in range(1, users + 1):
+            for game, team in tournament.random_picks(rnd).items():
+                predictions.append(dict(user_id=user_id, game_id=game, winning_team_id=team))
+            if len(predictions) >= CHUNK:
+                _insert(Prediction.__table__, predictions)
+                predictions = []
+    _insert(Prediction.__table__, predictions)
+    return tournaments
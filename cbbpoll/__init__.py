@@ -5,6 +5,7 @@ from flask_login import LoginManager
 from flask_mail import Mail
 from flask_migrate import Migrate
 import praw
+from threading import local
 
 
 app = Flask(__name__)
@@ -25,14 +26,28 @@ if not app.debug:
     file_handler.setLevel(logging.WARNING)
     app.logger.addHandler(file_handler)
 
-bot = praw.Reddit(
-    client_id=app.config['BOT_REDDIT_CLIENT_ID'],
-    client_secret=app.config['BOT_REDDIT_CLIENT_SECRET'],
-    username=app.config['BOT_REDDIT_USERNAME'],
-    password=app.config['BOT_REDDIT_PASSWORD'],
-    user_agent=app.config['BOT_REDDIT_USER_AGENT'],
-    )
+def make_bot():
+    return praw.Reddit(
+        client_id=app.config['BOT_REDDIT_CLIENT_ID'],
+        client_secret=app.config['BOT_REDDIT_CLIENT_SECRET'],
+        username=app.config['BOT_REDDIT_USERNAME'],
+        password=app.config['BOT_REDDIT_PASSWORD'],
+        user_agent=app.config['BOT_REDDIT_USER_AGENT'],
+        )
+
+bot = make_bot()
+_local = local()
+
+def thread_bot():
+    """This thread's own Reddit client, since praw isn't thread safe."""
+    client = getattr(_local, 'bot', None)
+    if client is None:
+        client = _local.bot = make_bot()
+    return client
 
 from cbbpoll import views, models, admin
+if app.config.get('INSTRUMENT'):
+    from cbbpoll import instrument
+    instrument.install()
 lm.anonymous_user = models.AnonymousUser
 app.jinja_env.globals['timestamp'] = views.timestamp
\ No newline at end of file
@@ -1,17 +1,20 @@
-from flask import redirect, url_for
-from flask_admin import Admin
+from flask import redirect, url_for, request, jsonify, abort, flash
+from flask_admin import Admin, BaseView
 from flask_admin.actions import action
 from flask_admin.base import AdminIndexView, expose
 from flask_admin.contrib.sqla import ModelView
 from flask_admin.form.fields import Select2Field
 from flask_login import current_user
+from wtforms import SubmitField
 from wtforms.validators import InputRequired
 from flask_wtf import FlaskForm as flask_wtf__Form
 from datetime import datetime, timedelta
-from botactions import update_flair
+from botactions import update_flairs
+from usercache import invalidate_users
+import instrument
 
 from cbbpoll import app, db
-from models import User, Team
+from models import User, Team, set_voters
 
 
 def teamChoices():
@@ -47,7 +50,7 @@ class UserAdmin(AdminModelView):
     column_sortable_list = ('id', 'nickname', 'email', 'emailConfirmed', 'role', 'applicationFlag', 'flair_team.full_name')
     column_searchable_list = ('nickname', 'email')
     form_overrides = dict(role=Select2Field)
-    column_filters = ('flair_team.full_name', 'flair_team.conference')
+    column_filters = ('flair_team.full_name', 'flair_team.conference', 'voter', 'applicationFlag')
     form_args = dict(
     # Pass the choices to the `SelectField`
         role=dict(
@@ -56,23 +59,35 @@ class UserAdmin(AdminModelView):
 
     @action('promote', 'Make Voter', 'Are you sure you want to grant voter status to the selected users?')
     def action_promote(self, ids):
-        pass
+        count = set_voters([int(id) for id in ids], True)
+        flash('%d users are now voters.' % count, 'success')
 
     @action('demote', 'Revoke Voter Status', 'Are you sure you want to revoke voter status from the selected users?')
     def action_demote(self, ids):
-        pass
+        count = set_voters([int(id) for id in ids], False)
+        flash('%d users are no longer voters.' % count, 'success')
 
-    @action('update_flair', 'Update Flair', 'Update flair on the selected users? This may take some time and increase response time')
+    @action('update_flair', 'Update Flair', 'Update flair on the selected users? This runs in the background.')
     def action_update_flair(self, ids):
-        pass
+        update_flairs([int(id) for id in ids])
+        flash('Updating flair for %d users in the background. Progress: %s' % (len(ids), url_for('_flair_sync')),
+              'success')
 
     @action('voter_flag','Flag for Voting', 'Flag selected users for voting?')
     def action_voter_flag(self, ids):
-        pass
+        self._set_flag(ids, True)
 
     @action('voter_unflag','Unflag for Voting', 'Unflag selected users for voting?')
     def action_voter_unflag(self, ids):
-        pass
+        self._set_flag(ids, False)
+
+    def _set_flag(self, ids, value):
+        ids = [int(id) for id in ids]
+        count = User.query.filter(User.id.in_(ids)) \
+            .update({User.applicationFlag: value}, synchronize_session=False)
+        db.session.commit()
+        invalidate_users(ids)
+        flash('%s %d users.' % ('Flagged' if value else 'Unflagged', count), 'success')
 
 
 class TeamAdmin(AdminModelView):
@@ -83,9 +98,37 @@ class TeamAdmin(AdminModelView):
     column_searchable_list = ('full_name', 'short_name', 'nickname', 'conference')
 
 
+class ResetStatsForm(flask_wtf__Form):
+    submit = SubmitField('Reset')
+
+
+class StatsView(BaseView):
+    def is_accessible(self):
+        return current_user.is_admin()
+
+    def inaccessible_callback(self, name, **kwargs):
+        abort(403)
+
+    @expose('/')
+    def index(self):
+        return self.render('admin/stats.html', enabled=instrument.installed(), endpoints=instrument.snapshot(),
+                           form=ResetStatsForm())
+
+    @expose('/json')
+    def json(self):
+        return jsonify(enabled=instrument.installed(), endpoints=instrument.snapshot())
+
+    @expose('/reset', methods=['POST'])
+    def reset(self):
+        if not ResetStatsForm().validate_on_submit():
+            abort(400)
+        instrument.reset()
+        return redirect(url_for('.index'))
+
 
 # Create admin
 admin = Admin(name='User Poll Control Panel', index_view=MyAdminIndexView(endpoint="admin"))
 admin.init_app(app)
 admin.add_view(TeamAdmin(Team, db.session))
 admin.add_view(UserAdmin(User, db.session))
+admin.add_view(StatsView(name='Stats', endpoint='stats'))
@@ -1,10 +1,131 @@
-from cbbpoll import app, db, bot
-from models import User, Team
-from decorators import async
+"""Keep User.flair in step with users' flair on the subreddit.
+
+A bulk sync fetches flair for a batch of users with at most
+FLAIR_FETCH_WORKERS requests in flight, each worker thread using its own
+Reddit client since praw isn't thread safe.  Past FLAIR_LIST_THRESHOLD
+users it is cheaper to page through the subreddit's whole flair list, a
+thousand users per call.  Flair CSS classes are matched to teams through
+the team index and the results are written back FLAIR_WRITE_BATCH users per
+UPDATE.  Progress is stored on the sync's job row and shown at /_flair_sync.
+The sync run for one user at login just fetches that user's flair.
+"""
+import json
+from multiprocessing.pool import ThreadPool
+from sqlalchemy import case
+from cbbpoll import app, db, thread_bot
+from models import User, Job
+from decorators import queued
+from jobs import report_progress
+from teamindex import team_index
+from usercache import invalidate_users
+
+# Progress is stored after this many users have been fetched.
+PROGRESS_EVERY = 100
+
 
 def team_by_flair(flair):
-    return Team.query.filter_by(flair = flair).first()
+    return team_index().by_flair.get(flair) if flair else None
+
+@queued
+def update_flair(user_id, nickname):
+    nickname, css, ok = fetch_one(nickname)
+    if ok:
+        team = team_by_flair(css)
+        write_flair({user_id: team.id if team else None})
+    return user_id
+
+@queued
+def update_flairs(user_ids):
+    """Sync flair for many users; what the admin action queues."""
+    users = db.session.query(User.id, User.nickname).filter(User.id.in_(user_ids)).all()
+    sync_flair(users)
+
+
+def flair_progress():
+    """How far the latest bulk sync has got."""
+    job = Job.query.filter_by(task='update_flairs').order_by(Job.id.desc()).first()
+    progress = dict(running=False, total=0, fetched=0, failed=0, updated=0, started=None, finished=None)
+    if job is not None:
+        progress.update(json.loads(job.progress or '{}'))
+        progress.update(running=job.status in ('pending', 'running'), started=job.created,
+                        finished=job.updated if job.status in ('done', 'failed') else None)
+    return progress
+
+
+def _css_class(flair):
+    css = (flair.get('flair_css_class') or '').split()
+    return css[0] if css else None
+
+
+def fetch_one(nickname, client=None):
+    """Return (nickname, css class or None, ok) for one user."""
+    client = client or thread_bot()
+    try:
+        for flair in client.subreddit(app.config['REDDIT_SUB']).flair(redditor=nickname):
+            return nickname, _css_class(flair), True
+        return nickname, None, True
+    except Exception:
+        app.logger.exception('Fetching flair for %s failed', nickname)
+        return nickname, None, False
+
+
+def fetch_flair(nicknames, client=None, fetch=fetch_one):
+    """Yield (nickname, css class or None, ok) for every nickname."""
+    if len(nicknames) > app.config.get('FLAIR_LIST_THRESHOLD', 500):
+        wanted = set(nickname.lower() for nickname in nicknames)
+        found = {}
+        for flair in (client or thread_bot()).subreddit(app.config['REDDIT_SUB']).flair(limit=None):
+            name = flair['user'].name.lower()
+            if name in wanted:
+                found[name] = _css_class(flair)
+        for nickname in nicknames:
+            yield nickname, found.get(nickname.lower()), True
+        return
+    pool = ThreadPool(app.config.get('FLAIR_FETCH_WORKERS', 4))
+    try:
+        for result in pool.imap_unordered(fetch, nicknames):
+            yield result
+    finally:
+        # Also stops the fetches still queued if the caller gave up early.
+        pool.terminate()
+        pool.join()
+
+
+def write_flair(team_by_user):
+    """Set User.flair for every user id in team_by_user with one UPDATE."""
+    if not team_by_user:
+        return 0
+    table = User.__table__
+    count = db.engine.execute(table.update()
+                              .where(table.c.id.in_(list(team_by_user)))
+                              .values(flair=case(team_by_user, value=table.c.id))).rowcount
+    invalidate_users(list(team_by_user))
+    return count
+
+
+def sync_flair(users, fetch=fetch_one):
+    """Fetch and store flair for (user id, nickname) pairs.
 
-@async
-def update_flair(user, redditor):
-    return user
+    Returns the counts it also reports as the job's progress.
+    """
+    user_ids = dict((nickname.lower(), user_id) for user_id, nickname in users if nickname)
+    progress = dict(total=len(users), fetched=0, failed=0, updated=0)
+    report_progress(**progress)
+    batch = {}
+    batch_size = app.config.get('FLAIR_WRITE_BATCH', 1000)
+    for nickname, css, ok in fetch_flair([nickname for _, nickname in users if nickname], fetch=fetch):
+        if ok:
+            progress['fetched'] += 1
+            team = team_by_flair(css)
+            batch[user_ids[nickname.lower()]] = team.id if team else None
+        else:
+            progress['failed'] += 1
+        if len(batch) >= batch_size:
+            progress['updated'] += write_flair(batch)
+            batch = {}
+        if (progress['fetched'] + progress['failed']) % PROGRESS_EVERY == 0:
+            report_progress(**progress)
+    progress['updated'] += write_flair(batch)
+    report_progress(**progress)
+    app.logger.info('Flair sync: %(fetched)d fetched, %(failed)d failed, %(updated)d updated', progress)
+    return progress
@@ -0,0 +1,145 @@
+"""Server-side cache of rendered pages for anonymous visitors.
+
+Pages are stored whole with an ETag and Last-Modified time, so repeat
+visitors get a 304 and everyone else gets the stored body without touching
+the database.  PAGE_CACHE selects the store: 'memory' for a per-process
+LRU, 'filesystem' to share entries between processes through
+PAGE_CACHE_DIR, or None to turn caching off.  Either store holds at most
+PAGE_CACHE_SIZE pages.  Conference and Team commit
+hooks in models clear it; entries also expire after PAGE_CACHE_TTL seconds
+so other processes' memory caches catch up.
+"""
+import cPickle as pickle
+import os
+import tempfile
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from hashlib import md5, sha1
+from threading import Lock
+from time import time
+from cbbpoll import app
+
+Page = namedtuple('Page', 'body status mimetype etag last_modified expires')
+
+_store = [None]
+_store_lock = Lock()
+
+
+class LRUCache(object):
+    """Keep the max_entries most recently used pages in this process."""
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key):
+        with self._lock:
+            page = self._entries.pop(key, None)
+            if page is not None:
+                self._entries[key] = page
+            return page
+
+    def set(self, key, page):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = page
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class FileCache(object):
+    """Keep pages as files in directory, shared by every process using it.
+
+    Each write removes files older than ttl seconds, then the oldest files
+    past max_entries.
+    """
+
+    def __init__(self, directory, max_entries=256, ttl=60):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def _path(self, key):
+        return os.path.join(self.directory, sha1(key.encode('utf-8')).hexdigest() + '.page')
+
+    def get(self, key):
+        try:
+            with open(self._path(key), 'rb') as f:
+                return Page(*pickle.load(f))
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, page):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(tuple(page), f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, self._path(key))
+        self.prune()
+
+    def prune(self):
+        pages = []
+        expired = time() - self.ttl
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                modified = os.path.getmtime(path)
+            except OSError:
+                continue
+            # Also catches temporary files left behind by writers that died.
+            if modified < expired:
+                self._remove(path)
+            elif name.endswith('.page'):
+                pages.append((modified, path))
+        if len(pages) > self.max_entries:
+            for _, path in sorted(pages)[:len(pages) - self.max_entries]:
+                self._remove(path)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith('.page'):
+                self._remove(os.path.join(self.directory, name))
+
+
+def page_cache():
+    """This process's page store, or None when caching is off."""
+    if _store[0] is None:
+        with _store_lock:
+            if _store[0] is None:
+                backend = app.config.get('PAGE_CACHE', 'memory')
+                if backend == 'memory':
+                    _store[0] = LRUCache(app.config.get('PAGE_CACHE_SIZE', 256))
+                elif backend == 'filesystem':
+                    _store[0] = FileCache(app.config['PAGE_CACHE_DIR'], app.config.get('PAGE_CACHE_SIZE', 256),
+                                          app.config.get('PAGE_CACHE_TTL', 60))
+                else:
+                    _store[0] = False
+    return _store[0] or None
+
+
+def make_page(response):
+    body = response.get_data()
+    return Page(body, response.status_code, response.mimetype, md5(body).hexdigest(),
+                datetime.utcnow().replace(microsecond=0), time() + app.config.get('PAGE_CACHE_TTL', 60))
+
+
+def invalidate_pages():
+    store = page_cache()
+    if store is not None:
+        store.clear()
@@ -1,8 +1,54 @@
-from threading import Thread
+from functools import wraps
+from time import time
+from flask import request, session, make_response
+from flask_login import current_user
+from jobs import task, enqueue
+from cache import page_cache, make_page
 
 
-def async(f):
+def queued(f=None, per_minute=None, serial=False):
+    """Run calls to f on the background job queue instead of inline.
+
+    @queued(per_minute='SETTING') starts at most that setting's number of
+    calls a minute; @queued(serial=True) runs calls one at a time, in the
+    order they were queued.
+    """
+    if f is None:
+        return lambda f: queued(f, per_minute, serial)
+    task(f, per_minute, serial)
+    def wrapper(*args, **kwargs):
+        enqueue(f.__name__, args, kwargs)
+    wrapper.__name__ = f.__name__
+    return wrapper
+
+
+def cached_for_anonymous(f):
+    """Serve anonymous GETs of the view from the page cache.
+
+    Logged in users, and anyone with a flashed message waiting, always get
+    a fresh render.  Pages are keyed on the path alone, so made-up query
+    strings can't fill the cache; cached views must not read request.args.
+    """
+    @wraps(f)
     def wrapper(*args, **kwargs):
-        thr = Thread(target=f, args=args, kwargs=kwargs)
-        thr.start()
+        store = page_cache()
+        if store is None or request.method != 'GET' or not current_user.is_anonymous \
+                or '_flashes' in session:
+            return f(*args, **kwargs)
+        key = request.path
+        page = store.get(key)
+        if page is None or page.expires < time():
+            response = make_response(f(*args, **kwargs))
+            if response.status_code != 200 or response.direct_passthrough or session.modified:
+                return response
+            page = make_page(response)
+            store.set(key, page)
+        response = make_response(page.body, page.status)
+        response.mimetype = page.mimetype
+        response.set_etag(page.etag)
+        response.last_modified = page.last_modified
+        response.cache_control.public = True
+        response.cache_control.no_cache = True
+        response.vary.add('Cookie')
+        return response.make_conditional(request)
     return wrapper
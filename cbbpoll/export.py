@@ -0,0 +1,78 @@
+"""Streaming export of every bracket pick with the picker's score.
+
+Rows come off a server-side cursor BATCH_SIZE at a time (Query.yield_per)
+and are written out one line at a time, so memory stays flat however many
+predictions there are.
+"""
+import csv
+import json
+from sqlalchemy import and_
+from sqlalchemy.orm import aliased
+from cbbpoll import db
+from models import User, Team, Conference, Game, Result, Prediction, Score
+
+BATCH_SIZE = 1000
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+COLUMNS = ['user_id', 'nickname', 'conference_id', 'conference', 'game_id', 'point_value',
+           'team_id', 'team', 'winning_team_id', 'correct', 'points', 'max_remaining', 'rank']
+
+
+def export_rows(conference_id=None):
+    """Yield one tuple per prediction, in COLUMNS order, grouped by user."""
+    picked = aliased(Team)
+    query = db.session.query(
+        Prediction.user_id, User.nickname, Game.conference_id, Conference.name, Prediction.game_id,
+        Game.point_value, Prediction.winning_team_id, picked.short_name, Result.winning_team_id,
+        Score.points, Score.max_remaining, Score.rank) \
+        .join(Game, Prediction.game_id == Game.id) \
+        .join(Conference, Game.conference_id == Conference.id) \
+        .join(User, Prediction.user_id == User.id) \
+        .outerjoin(picked, Prediction.winning_team_id == picked.id) \
+        .outerjoin(Result, Result.game_id == Game.id) \
+        .outerjoin(Score, and_(Score.user_id == Prediction.user_id, Score.conference_id == Game.conference_id)) \
+        .order_by(Prediction.user_id, Game.conference_id, Prediction.game_id)
+    if conference_id is not None:
+        query = query.filter(Game.conference_id == conference_id)
+    for (user_id, nickname, conference_id, conference, game_id, point_value, team_id, team, winner,
+         points, max_remaining, rank) in query.yield_per(BATCH_SIZE):
+        correct = None if winner is None else team_id == winner
+        yield (user_id, nickname, conference_id, conference, game_id, point_value, team_id, team, winner,
+               correct, points, max_remaining, rank)
+
+
+class _Line(object):
+    """File-like target that keeps only the last line csv.writer wrote."""
+    value = ''
+
+    def write(self, value):
+        self.value = value
+
+
+def _utf8(value):
+    return value.encode('utf-8') if isinstance(value, unicode) else value
+
+
+def csv_lines(rows):
+    line = _Line()
+    writer = csv.writer(line)
+    writer.writerow(COLUMNS)
+    yield line.value
+    for row in rows:
+        writer.writerow([_utf8(value) for value in row])
+        yield line.value
+
+
+def ndjson_lines(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(COLUMNS, row)), sort_keys=True) + '\n'
+
+
+def export_lines(format, conference_id=None):
+    """Generate the export as lines of text in format ('csv' or 'ndjson')."""
+    rows = export_rows(conference_id)
+    if format == 'csv':
+        return csv_lines(rows)
+    return ndjson_lines(rows)
@@ -0,0 +1,156 @@
+"""Opt-in timing of requests, SQL and template rendering, per endpoint.
+
+Turned on with INSTRUMENT = True.  Each request counts its queries and
+adds up time spent in the database and in render_template; the totals are
+gathered per endpoint in this process, along with the slowest statements
+seen.  The admin stats page shows them, busiest endpoint first, and
+/admin/stats/json dumps them.  Responses to admins also get a
+Server-Timing header so the numbers show up in the browser's network tab.
+"""
+import heapq
+from threading import Lock
+from time import time
+from flask import g, request, has_request_context, before_render_template, template_rendered
+from flask_login import current_user
+from sqlalchemy import event
+from cbbpoll import app, db
+
+SLOWEST_STATEMENTS = 5
+
+_endpoints = {}
+_lock = Lock()
+_installed = [False]
+
+
+class EndpointStats(object):
+    __slots__ = ('requests', 'total_ms', 'max_ms', 'queries', 'db_ms', 'render_ms', 'slowest')
+
+    def __init__(self):
+        self.requests = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.queries = 0
+        self.db_ms = 0.0
+        self.render_ms = 0.0
+        self.slowest = []
+
+    def add(self, elapsed_ms, current):
+        self.requests += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        self.queries += current['queries']
+        self.db_ms += current['db_ms']
+        self.render_ms += current['render_ms']
+        for slow in current['statements']:
+            if len(self.slowest) < SLOWEST_STATEMENTS:
+                heapq.heappush(self.slowest, slow)
+            elif slow > self.slowest[0]:
+                heapq.heapreplace(self.slowest, slow)
+
+    def as_dict(self):
+        n = float(self.requests or 1)
+        return dict(requests=self.requests,
+                    total_ms=round(self.total_ms, 1),
+                    avg_ms=round(self.total_ms / n, 1),
+                    max_ms=round(self.max_ms, 1),
+                    avg_queries=round(self.queries / n, 1),
+                    avg_db_ms=round(self.db_ms / n, 1),
+                    avg_render_ms=round(self.render_ms / n, 1),
+                    slowest=[dict(ms=round(ms, 1), statement=statement)
+                             for ms, statement in sorted(self.slowest, reverse=True)])
+
+
+def _current():
+    if has_request_context():
+        return getattr(g, '_instrument', None)
+
+
+def _start_request():
+    g._instrument = dict(started=time(), queries=0, db_ms=0.0, render_ms=0.0, statements=[], rendering=[])
+
+
+def _finish_request(response):
+    current = _current()
+    if current is None:
+        return response
+    elapsed = (time() - current['started']) * 1000
+    endpoint = request.endpoint or '<unmatched>'
+    with _lock:
+        _endpoints.setdefault(endpoint, EndpointStats()).add(elapsed, current)
+    if current_user.is_authenticated and current_user.is_admin():
+        response.headers['Server-Timing'] = 'db;dur=%.1f, render;dur=%.1f, total;dur=%.1f' % (
+            current['db_ms'], current['render_ms'], elapsed)
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('instrument_started', []).append(time())
+    if context is not None:
+        context._instrument_timed = True
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info['instrument_started'].pop()
+    if context is not None:
+        context._instrument_timed = False
+    current = _current()
+    if current is None:
+        return
+    elapsed = (time() - started) * 1000
+    current['queries'] += 1
+    current['db_ms'] += elapsed
+    current['statements'].append((elapsed, statement))
+
+
+def _handle_error(context):
+    # A statement that failed never reaches _after_cursor_execute; drop its
+    # start time so it doesn't skew the next statement on the connection.
+    execution = context.execution_context
+    if execution is not None and getattr(execution, '_instrument_timed', False):
+        execution._instrument_timed = False
+        context.connection.info['instrument_started'].pop()
+
+
+def _before_render(sender, template, context, **extra):
+    current = _current()
+    if current is not None:
+        current['rendering'].append(time())
+
+
+def _rendered(sender, template, context, **extra):
+    current = _current()
+    if current is not None and current['rendering']:
+        started = current['rendering'].pop()
+        # A template rendered from inside another is part of the outer one's time.
+        if not current['rendering']:
+            current['render_ms'] += (time() - started) * 1000
+
+
+def install():
+    """Start recording; safe to call more than once."""
+    if _installed[0]:
+        return
+    _installed[0] = True
+    event.listen(db.engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(db.engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(db.engine, 'handle_error', _handle_error)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def installed():
+    return _installed[0]
+
+
+def snapshot():
+    """Stats per endpoint, the endpoint with the most total time first."""
+    with _lock:
+        rows = [dict(endpoint=endpoint, **stats.as_dict()) for endpoint, stats in _endpoints.items()]
+    return sorted(rows, key=lambda row: row['total_ms'], reverse=True)
+
+
+def reset():
+    with _lock:
+        _endpoints.clear()
@@ -0,0 +1,306 @@
+"""Durable background jobs run by a bounded pool of worker threads.
+
+Jobs are rows in the job table, so they survive restarts.  Each process
+runs at most JOB_WORKERS threads, started on the first enqueue (or by the
+'worker' manager command); with JOB_WORKERS = 0 a process only queues
+jobs.  A worker claims a job with a conditional UPDATE, so each job runs
+once however many processes are working the queue.
+
+Failed jobs are retried with exponential backoff up to JOB_MAX_ATTEMPTS
+times.  A task can instead raise Retry to be retried with new arguments,
+Fail to give up at once, or Throttled to be put back without using an
+attempt.  A task registered with a per-minute limit is started at most
+that many times in any minute across all processes (give or take a job
+per worker thread).
+
+A serial task runs one job at a time across all processes, in the order
+the jobs were queued.  Its oldest pending job heads the queue, so while
+that job waits out a backoff or a Throttled delay, the whole task waits.
+
+A long task can record how far it has got with report_progress(), which
+also keeps its job from looking stale.
+
+On exit the pool finishes the jobs that are ready, waiting up to
+JOB_DRAIN_TIMEOUT seconds.  Jobs a crashed process left running are picked
+up again once they go stale; every working process looks for them once
+per POLL_INTERVAL.
+"""
+import atexit
+import json
+from datetime import datetime, timedelta
+from threading import Thread, Lock, Event, local
+from Queue import Queue, Empty
+from sqlalchemy import select, func, exists
+from cbbpoll import app, db
+
+POLL_INTERVAL = 5
+STALE_AFTER = timedelta(minutes=10)
+
+_tasks = {}
+# Task name to the setting holding its per-minute limit.
+_limits = {}
+_serial = set()
+_wakeup = Queue()
+_workers = []
+_workers_lock = Lock()
+_started = Event()
+_draining = Event()
+_running = local()
+# When this process last looked for stale jobs.
+_requeued = [datetime.min]
+_requeue_lock = Lock()
+
+
+class Retry(Exception):
+    """Raised by a task to be retried with new arguments, such as only the
+    part of a batch it didn't get through.  error is what went wrong."""
+
+    def __init__(self, error, args=(), kwargs=None):
+        Exception.__init__(self, error)
+        self.error = error
+        self.retry_args = list(args)
+        self.retry_kwargs = kwargs or {}
+
+
+class Fail(Exception):
+    """Raised by a task that can never succeed; the job fails without
+    further attempts.  error is what went wrong."""
+
+    def __init__(self, error):
+        Exception.__init__(self, error)
+        self.error = error
+
+
+class Throttled(Exception):
+    """Raised by a task the far end asked to slow down.  The job is put back
+    without using an attempt, to run after seconds; for a serial task that
+    holds back the whole task."""
+
+    def __init__(self, seconds):
+        Exception.__init__(self, seconds)
+        self.seconds = seconds
+
+
+def task(f, per_minute=None, serial=False):
+    """Register f so queued calls to it can be run by name.
+
+    per_minute names the setting that limits how many calls to f are
+    started a minute.  serial runs the calls one at a time, in order.
+    """
+    _tasks[f.__name__] = f
+    if per_minute:
+        _limits[f.__name__] = per_minute
+    if serial:
+        _serial.add(f.__name__)
+    return f
+
+
+def enqueue(name, args=(), kwargs=None):
+    """Store a call to task name; arguments must be JSON serializable."""
+    payload = json.dumps([list(args), kwargs or {}])
+    if app.config.get('JOBS_INLINE'):
+        return _tasks[name](*args, **(kwargs or {}))
+    _store([_row(name, payload)])
+
+
+def enqueue_many(name, calls):
+    """Store one call to task name per args tuple in calls, with one INSERT."""
+    if app.config.get('JOBS_INLINE'):
+        for args in calls:
+            _tasks[name](*args)
+        return
+    if calls:
+        _store([_row(name, json.dumps([list(args), {}])) for args in calls])
+
+
+def _row(name, payload):
+    now = datetime.utcnow()
+    return dict(task=name, payload=payload, status='pending', attempts=0, run_after=now, created=now, updated=now)
+
+
+def _store(rows):
+    from models import Job
+    db.engine.execute(Job.__table__.insert(), rows)
+    start()
+    _wakeup.put(None)
+
+
+def start(workers=None):
+    """Start this process's worker threads if they aren't running."""
+    with _workers_lock:
+        if _started.is_set():
+            return
+        _started.set()
+        workers = app.config.get('JOB_WORKERS', 4) if workers is None else workers
+        if not workers:
+            return
+        _requeue_stale()
+        for _ in range(workers):
+            worker = Thread(target=_work)
+            worker.daemon = True
+            worker.start()
+            _workers.append(worker)
+
+
+def shutdown(timeout=None):
+    """Let workers finish the jobs that are ready now, then stop them."""
+    _draining.set()
+    timeout = app.config.get('JOB_DRAIN_TIMEOUT', 30) if timeout is None else timeout
+    deadline = datetime.utcnow() + timedelta(seconds=timeout)
+    for worker in list(_workers):
+        _wakeup.put(None)
+    for worker in list(_workers):
+        worker.join(max((deadline - datetime.utcnow()).total_seconds(), 0))
+
+atexit.register(shutdown)
+
+
+def _requeue_stale():
+    """Put back jobs left running too long, at most once per POLL_INTERVAL."""
+    with _requeue_lock:
+        now = datetime.utcnow()
+        if now - _requeued[0] < timedelta(seconds=POLL_INTERVAL):
+            return
+        _requeued[0] = now
+    from models import Job
+    table = Job.__table__
+    db.engine.execute(table.update()
+                      .where(table.c.status == 'running')
+                      .where(table.c.updated < datetime.utcnow() - STALE_AFTER)
+                      .values(status='pending', updated=datetime.utcnow()))
+
+
+def _held_back(conn, now):
+    """Names of the tasks that shouldn't be started now."""
+    from models import Job
+    table = Job.__table__
+    names = []
+    for name in _serial:
+        head = conn.execute(select([table.c.status, table.c.run_after])
+                            .where(table.c.task == name)
+                            .where(table.c.status.in_(['pending', 'running']))
+                            .order_by(table.c.status == 'pending', table.c.id).limit(1)).first()
+        if head is not None and (head.status == 'running' or head.run_after > now):
+            names.append(name)
+    for name, setting in _limits.items():
+        limit = app.config.get(setting)
+        if not limit or name in names:
+            continue
+        # Rows leave 'pending' when claimed and are touched again when they
+        # finish, so this counts every start in the last minute at least once.
+        started = conn.execute(select([func.count()]).select_from(table)
+                               .where(table.c.task == name)
+                               .where(table.c.updated > now - timedelta(minutes=1))
+                               .where(table.c.status != 'pending')).scalar()
+        if started >= limit:
+            names.append(name)
+    return names
+
+
+def _claim():
+    from models import Job
+    table = Job.__table__
+    while True:
+        with db.engine.begin() as conn:
+            now = datetime.utcnow()
+            query = select([table]).where(table.c.status == 'pending').where(table.c.run_after <= now)
+            held_back = _held_back(conn, now)
+            if held_back:
+                query = query.where(~table.c.task.in_(held_back))
+            job = conn.execute(query.order_by(table.c.id).limit(1)).first()
+            if job is None:
+                return None
+            claim = table.update().where(table.c.id == job.id).where(table.c.status == 'pending')
+            if job.task in _serial:
+                # Another process may have started one meanwhile.  The LIMIT
+                # keeps MySQL from merging the derived table, which it
+                # would then refuse to read while updating job.
+                running = select([table.c.id]).where(table.c.task == job.task) \
+                    .where(table.c.status == 'running').limit(1).alias('running')
+                claim = claim.where(~exists(select([running.c.id])))
+            claimed = conn.execute(claim.values(status='running', attempts=job.attempts + 1,
+                                                updated=datetime.utcnow())).rowcount
+        if claimed:
+            return job
+
+
+def _finish(job, error=None, payload=None, give_up=False):
+    from models import Job
+    table = Job.__table__
+    now = datetime.utcnow()
+    values = dict(status='done', updated=now)
+    if payload is not None:
+        values['payload'] = payload
+    if error is not None:
+        attempts = job.attempts + 1
+        values['last_error'] = error
+        if give_up or attempts >= app.config.get('JOB_MAX_ATTEMPTS', 5):
+            values['status'] = 'failed'
+        else:
+            backoff = app.config.get('JOB_RETRY_BACKOFF', 30) * 2 ** (attempts - 1)
+            values.update(status='pending', run_after=now + timedelta(seconds=backoff))
+    db.engine.execute(table.update().where(table.c.id == job.id).values(**values))
+
+
+def _release(job, seconds):
+    """Put a claimed job back as it was, to run after seconds."""
+    from models import Job
+    table = Job.__table__
+    now = datetime.utcnow()
+    db.engine.execute(table.update().where(table.c.id == job.id)
+                      .values(status='pending', attempts=job.attempts, updated=now,
+                              run_after=now + timedelta(seconds=seconds)))
+
+
+def run(job):
+    args, kwargs = json.loads(job.payload)
+    f = _tasks.get(job.task)
+    if f is None:
+        _finish(job, 'Unknown task %r' % job.task)
+        return
+    _running.job_id = job.id
+    try:
+        with app.app_context():
+            f(*args, **kwargs)
+    except Throttled as e:
+        app.logger.warning('Job %s (%s) throttled for %ds', job.id, job.task, e.seconds)
+        _release(job, e.seconds)
+    except Fail as e:
+        app.logger.warning('Job %s (%s) failed for good: %r', job.id, job.task, e.error)
+        _finish(job, repr(e.error), give_up=True)
+    except Retry as e:
+        app.logger.warning('Job %s (%s) will be retried: %r', job.id, job.task, e.error)
+        _finish(job, repr(e.error), json.dumps([e.retry_args, e.retry_kwargs]))
+    except Exception as e:
+        app.logger.exception('Job %s (%s) failed', job.id, job.task)
+        _finish(job, repr(e))
+    else:
+        _finish(job)
+    finally:
+        _running.job_id = None
+
+
+def report_progress(**values):
+    """Store values as the progress of the job running in this thread, if any."""
+    job_id = getattr(_running, 'job_id', None)
+    if job_id is None:
+        return
+    from models import Job
+    table = Job.__table__
+    db.engine.execute(table.update().where(table.c.id == job_id)
+                      .values(progress=json.dumps(values), updated=datetime.utcnow()))
+
+
+def _work():
+    while True:
+        _requeue_stale()
+        job = _claim()
+        if job is not None:
+            run(job)
+            continue
+        if _draining.is_set():
+            return
+        try:
+            _wakeup.get(timeout=POLL_INTERVAL)
+        except Empty:
+            pass
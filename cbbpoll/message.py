@@ -1,30 +1,187 @@
+import re
+from time import time
 from flask import render_template
 from flask_mail import Message
-from cbbpoll import app, mail, bot
-from decorators import async
+from jinja2 import nodes
+from praw.exceptions import APIException
+from cbbpoll import app, mail, thread_bot
+from decorators import queued
+from jobs import Retry, Fail, Throttled, enqueue_many
 
-@async
-def send_async_email(app, msg):
+FIELD_MARK = u'\x1e%s\x1f'
+FIELD = re.compile(u'\x1e(\\w+)\x1f')
+# Seconds to hold PMs back after a RATELIMIT error that doesn't say how long
+RATELIMIT_DEFAULT = 60
+# Reddit errors that won't go away by trying again
+PERMANENT_ERRORS = ('USER_DOESNT_EXIST', 'NOT_WHITELISTED_BY_USER_MESSAGE', 'INVALID_USER')
+
+
+class _FieldMarker(object):
+    """Stands in for the recipient, printing a marker for each field used."""
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return FIELD_MARK % name
+
+
+def prints_fields_only(template):
+    """Whether template only ever prints recipient fields as they are.
+
+    Every use of ``user`` must be a bare ``{{ user.field }}``.  Anything
+    else (a test, a filter, a loop, or another template pulled in that
+    could see ``user``) might depend on the recipient's values.
+    """
+    env = app.jinja_env
+    ast = env.parse(env.loader.get_source(env, template)[0])
+    if any(ast.find_all((nodes.Extends, nodes.Include, nodes.Import, nodes.FromImport))):
+        return False
+    printed = set()
+    for output in ast.find_all(nodes.Output):
+        for node in output.nodes:
+            if isinstance(node, nodes.Getattr) and isinstance(node.node, nodes.Name) and node.node.name == 'user':
+                printed.add(id(node.node))
+    return all(id(name) in printed for name in ast.find_all(nodes.Name) if name.name == 'user')
+
+
+class CampaignTemplate(object):
+    """A notification template rendered once for a whole campaign.
+
+    The template is rendered with a marker in place of each field of the
+    recipient (``user``), so the text everyone shares is built once and
+    render(user) only joins it with the recipient's own values.  That is
+    only done for templates that do nothing with recipient fields but print
+    them; any other template is rendered in full for every recipient.
+    """
+
+    def __init__(self, template, **kwargs):
+        self.template = template
+        self.kwargs = kwargs
+        self.literals = self.fields = None
+        if prints_fields_only(template):
+            parts = FIELD.split(render_template(template, user=_FieldMarker(), **kwargs))
+            self.literals = parts[0::2]
+            self.fields = parts[1::2]
+
+    def render(self, user):
+        if self.fields is None:
+            return render_template(self.template, user=user, **self.kwargs)
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(unicode(getattr(user, field)))
+            parts.append(literal)
+        return u''.join(parts)
+
+
+@queued
+def send_async_email(subject, sender, recipients, body):
+    msg = Message(subject, sender = sender, recipients = recipients, body = body)
     if app.config['DEBUG']:
         print(msg)
         return
-    with app.app_context():
-        mail.send(msg)
+    mail.send(msg)
+
+@queued
+def send_email_batch(messages):
+    """Send [subject, sender, recipients, body] messages over one SMTP connection.
 
-@async
-def send_async_pm(recipient, subject, msg):
+    If sending fails part way, the job is retried with only the messages
+    that weren't sent.
+    """
     if app.config['DEBUG']:
-        print(recipient, subject, msg)
+        for subject, sender, recipients, body in messages:
+            print(recipients, subject, body)
         return
-    with app.app_context():
-        bot.send_message(recipient, subject, msg)
+    started = time()
+    sent = 0
+    try:
+        with mail.connect() as conn:
+            for subject, sender, recipients, body in messages:
+                conn.send(Message(subject, sender = sender, recipients = recipients, body = body))
+                sent += 1
+    except Exception as e:
+        if sent < len(messages):
+            raise Retry(e, [messages[sent:]])
+        app.logger.warning('Sent %d emails but closing the connection failed: %r', sent, e)
+    elapsed = time() - started
+    app.logger.info('Sent %d emails in %.2fs (%.1f/s)', len(messages), elapsed, len(messages) / max(elapsed, 1e-6))
 
 def send_email(subject, recipients, template, **kwargs):
-    msg = Message(subject, sender = app.config['MAIL_FROM'], recipients = recipients)
-    msg.body = render_template(template + '.txt', **kwargs)
+    body = render_template(template + '.txt', **kwargs)
     #msg.html = html_body
-    send_async_email(app, msg)
+    send_async_email(subject, app.config['MAIL_FROM'], recipients, body)
+
+def retry_after(message):
+    """Seconds to back off for a RATELIMIT message like 'try again in 5 minutes.'"""
+    match = re.search(r'(\d+) (minute|second)', message or '')
+    if not match:
+        return RATELIMIT_DEFAULT
+    seconds = int(match.group(1))
+    return seconds * 60 if match.group(2) == 'minute' else seconds
+
+@queued(per_minute='PM_PER_MINUTE', serial=True)
+def send_pm(recipient, subject, body):
+    if app.config['DEBUG']:
+        print(recipient, subject, body)
+        return
+    try:
+        thread_bot().redditor(recipient).message(subject, body)
+    except APIException as e:
+        if e.error_type == 'RATELIMIT':
+            raise Throttled(retry_after(e.message))
+        if e.error_type in PERMANENT_ERRORS:
+            raise Fail(e)
+        raise
+
+def queue_pms(messages):
+    """Queue (recipient, subject, body) messages, one send_pm job each."""
+    enqueue_many('send_pm', messages)
 
 def send_reddit_pm(recipient, subject, template, **kwargs):
     msg = render_template(template+'.md', **kwargs)
-    send_async_pm(recipient, subject, msg)
+    send_pm(recipient, subject, msg)
+
+def send_reminder_emails(subject, template, batch_size=None, **kwargs):
+    """Email everyone with confirmed email reminders turned on.
+
+    The template is rendered once for the campaign.  Recipients are read
+    batch_size at a time, and each batch is queued as one job that sends
+    over a single SMTP connection.  Returns the number of emails queued.
+    """
+    from models import User
+    batch_size = batch_size or app.config.get('MAIL_BATCH_SIZE', 50)
+    recipients = User.query.filter(User.remind_viaEmail == True) \
+        .with_entities(User.id, User.nickname, User.email)
+    sender = app.config['MAIL_FROM']
+    body = CampaignTemplate(template + '.txt', **kwargs)
+    last = 0
+    queued = 0
+    while True:
+        batch = recipients.filter(User.id > last).order_by(User.id).limit(batch_size).all()
+        if not batch:
+            return queued
+        send_email_batch([[subject, sender, [user.email], body.render(user)] for user in batch])
+        queued += len(batch)
+        last = batch[-1].id
+
+def send_reminder_pms(subject, template, batch_size=None, **kwargs):
+    """Queue a Reddit PM for everyone with PM reminders turned on.
+
+    Each PM is its own job, started at most PM_PER_MINUTE times a minute.
+    Recipients are read batch_size at a time.  Returns the number of PMs
+    queued.
+    """
+    from models import User
+    batch_size = batch_size or app.config.get('PM_BATCH_SIZE', 500)
+    recipients = User.query.filter(User.remind_viaRedditPM == True) \
+        .with_entities(User.id, User.nickname)
+    body = CampaignTemplate(template + '.md', **kwargs)
+    last = 0
+    queued = 0
+    while True:
+        batch = recipients.filter(User.id > last).order_by(User.id).limit(batch_size).all()
+        if not batch:
+            return queued
+        queue_pms([(user.nickname, subject, body.render(user)) for user in batch])
+        queued += len(batch)
+        last = batch[-1].id
@@ -1,18 +1,56 @@
 from flask import url_for
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from threading import local
 from cbbpoll import db, app
-from cbbpoll.message import send_reddit_pm
+from cbbpoll.message import send_reddit_pm, queue_pms, CampaignTemplate
+from teamindex import team_index, invalidate_team_index, png_url, render_logo
+from cache import invalidate_pages
+from usercache import invalidate_users
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from sqlalchemy import select, desc, UniqueConstraint
+from sqlalchemy import event, inspect, select, desc, exists, literal, bindparam, or_, Index, UniqueConstraint
 from sqlalchemy.ext.hybrid import hybrid_property, hybrid_method
+from sqlalchemy.orm import contains_eager
+from sqlalchemy.orm.collections import attribute_mapped_collection
 from flask_sqlalchemy import models_committed
 from flask_login import AnonymousUserMixin
 
 
+VOTER_GRANTED_SUBJECT = 'You are now an official voter'
+VOTER_REVOKED_SUBJECT = 'Your voter status has been revoked'
+
+
+_commit = local()
+
+
 def on_models_committed(_, changes):
-    for obj, change in changes:
-        if change == 'insert' and hasattr(obj, '__commit_insert__'):
-            obj.__commit_insert__()
+    outer = getattr(_commit, 'after', None)
+    _commit.after = OrderedDict()
+    try:
+        for obj, change in changes:
+            hook = getattr(obj, '__commit_%s__' % change, None)
+            if hook:
+                hook()
+        while _commit.after:
+            (f, args), _ = _commit.after.popitem(last=False)
+            f(*args)
+    finally:
+        _commit.after = outer
+
+
+def after_commit(f, *args):
+    """Call f(*args) once the commit hooks have all run.
+
+    Repeated requests for the same call within one commit collapse into one,
+    which runs after anything requested before it.  Outside a commit the
+    call runs straight away.
+    """
+    after = getattr(_commit, 'after', None)
+    if after is None:
+        f(*args)
+        return
+    after.pop((f, args), None)
+    after[(f, args)] = None
 
 models_committed.connect(on_models_committed, sender=app)
 
@@ -33,12 +71,15 @@ class User(db.Model):
     emailReminders = db.Column(db.Boolean, default=False)
     pmReminders = db.Column(db.Boolean, default=False)
     applicationFlag = db.Column(db.Boolean, default=False)
+    voter = db.Column(db.Boolean, default=False)
     flair = db.Column(db.Integer, db.ForeignKey('team.id'))
-    ballots = []
-
-    voterEvents = []
-
-    voterApplication = {}
+    # One Score row for each tournament the user has a bracket in.
+    ballots = db.relationship('Score', back_populates='user', lazy='dynamic',
+                              order_by='Score.conference_id.desc()')
+    voterEvents = db.relationship('VoterEvent', back_populates='user', lazy='dynamic',
+                                  order_by='VoterEvent.timestamp')
+    voterApplication = db.relationship('VoterApplication', back_populates='user',
+                                       collection_class=attribute_mapped_collection('season'))
 
     @property
     def is_authenticated(self):
@@ -97,33 +138,69 @@ class User(db.Model):
 
     @hybrid_property
     def remind_viaRedditPM(self):
-        return False
+        return self.pmReminders
 
     @hybrid_property
     def is_voter(self):
-        return False
+        return bool(self.voter)
 
     @is_voter.expression
     def is_voter(cls):
-        return False
+        return cls.voter
 
+    # The PM is queued by the commit hooks, so a change that is rolled back
+    # never tells the user anything.
     @is_voter.setter
     def is_voter(self, value):
-        pass
+        if bool(self.voter) == value:
+            return
+        self.voter = value
+        self._voter_pm = value
+        db.session.add(VoterEvent(user=self, timestamp=datetime.utcnow(), is_voter=value))
+
+    def _send_voter_pm(self):
+        value = self.__dict__.pop('_voter_pm', None)
+        if value is None or bool(self.voter) != value:
+            return
+        if value:
+            send_reddit_pm(self.nickname, VOTER_GRANTED_SUBJECT, 'pm_voter_granted', user=self)
+        else:
+            send_reddit_pm(self.nickname, VOTER_REVOKED_SUBJECT, 'pm_voter_revoked', user=self)
 
+    # The latest event at or before timestamp decides; on the
+    # (user_id, timestamp) index that is a single seek per user.  Timestamps
+    # can tie (MySQL keeps whole seconds), so the later row wins a tie.
     @hybrid_method
     def was_voter_at(self, timestamp):
-        return False
+        event = db.session.query(VoterEvent.is_voter) \
+            .filter(VoterEvent.user_id == self.id) \
+            .filter(VoterEvent.timestamp <= timestamp) \
+            .order_by(VoterEvent.timestamp.desc(), VoterEvent.id.desc()).first()
+        return bool(event and event.is_voter)
 
     @was_voter_at.expression
     def was_voter_at(cls, timestamp):
-        return False
+        return select([VoterEvent.is_voter]) \
+            .where(VoterEvent.user_id == cls.id) \
+            .where(VoterEvent.timestamp <= timestamp) \
+            .order_by(VoterEvent.timestamp.desc(), VoterEvent.id.desc()) \
+            .limit(1).as_scalar()
 
     def name_with_flair(self, size=30):
-        team = self.team
-        if not team:
+        if not self.flair:
             return str(self.nickname)
-        return "%s%s" % (team.logo_html(size), self.nickname)
+        return "%s%s" % (team_index().logo_html(self.flair, size), self.nickname)
+
+    def __commit_insert__(self):
+        invalidate_users([self.id])
+        self._send_voter_pm()
+
+    def __commit_update__(self):
+        invalidate_users([self.id])
+        self._send_voter_pm()
+
+    def __commit_delete__(self):
+        invalidate_users([self.id])
 
     def __repr__(self):
         return '<User %r>' % self.nickname
@@ -132,11 +209,112 @@ class User(db.Model):
         return str(self.nickname)
 
 
+def users_by_conference(query=None):
+    """Join each user's flair team into query, loading flair_team in the
+    same query so User.conference and name_with_flair don't hit the
+    database once per user.  Filter on Team.conference for one conference.
+    """
+    query = query if query is not None else User.query
+    return query.outerjoin(User.flair_team).options(contains_eager(User.flair_team))
+
+
+def set_voters(user_ids, value):
+    """Grant or revoke voter status for many users with one UPDATE.
+
+    One VoterEvent per changed user records the change in the same
+    transaction.
+
+    Users whose status actually changes get the matching PM, rendered once
+    and queued as one batch.  An unset status already counts as not a
+    voter, so revoking it is stored silently.  Returns the number of users
+    changed.
+    """
+    differs = or_(User.voter == None, User.voter != value)
+    # The rows stay locked until the commit, so two admins acting at once
+    # can't both change, and message, the same user.
+    stale = db.session.query(User.id, User.nickname, User.voter) \
+        .filter(User.id.in_(user_ids)).filter(differs) \
+        .with_for_update().all()
+    if not stale:
+        return 0
+    now = datetime.utcnow()
+    User.query.filter(User.id.in_([user.id for user in stale])).filter(differs) \
+        .update({User.voter: value}, synchronize_session=False)
+    changed = [user for user in stale if bool(user.voter) != value]
+    db.session.bulk_insert_mappings(VoterEvent, [
+        dict(user_id=user.id, timestamp=now, is_voter=value) for user in changed])
+    db.session.commit()
+    invalidate_users([user.id for user in stale])
+    template, subject = ('pm_voter_granted', VOTER_GRANTED_SUBJECT) if value else \
+        ('pm_voter_revoked', VOTER_REVOKED_SUBJECT)
+    body = CampaignTemplate(template + '.md')
+    queue_pms([(user.nickname, subject, body.render(user)) for user in changed])
+    return len(changed)
+
+
 class AnonymousUser(AnonymousUserMixin):
     def is_admin(self):
         return False
 
 
+class VoterEvent(db.Model):
+    __tablename__ = 'voter_event'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    is_voter = db.Column(db.Boolean, nullable=False)
+    __table_args__ = (
+        Index('ix_voter_event_user_timestamp', 'user_id', 'timestamp'),
+        {})
+    user = db.relationship('User', back_populates='voterEvents')
+
+
+voter_application_teams = db.Table(
+    'voter_application_teams',
+    db.Column('application_id', db.Integer, db.ForeignKey('voter_application.id'), primary_key=True),
+    db.Column('team_id', db.Integer, db.ForeignKey('team.id'), primary_key=True))
+
+voter_application_tags = db.Table(
+    'voter_application_tags',
+    db.Column('application_id', db.Integer, db.ForeignKey('voter_application.id'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('consumption_tag.id'), primary_key=True))
+
+
+class ConsumptionTag(db.Model):
+    __tablename__ = 'consumption_tag'
+    id = db.Column(db.Integer, primary_key=True)
+    text = db.Column(db.String(200), nullable=False)
+
+    def __repr__(self):
+        return '<ConsumptionTag %r>' % self.text
+
+    def __str__(self):
+        return self.text
+
+
+class VoterApplication(db.Model):
+    __tablename__ = 'voter_application'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    primary_team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
+    approach = db.Column(db.Text)
+    other_comments = db.Column(db.Text)
+    will_participate = db.Column(db.Boolean)
+    updated = db.Column(db.DateTime)
+    season = db.Column(db.Integer, nullable=False)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'season', name='one_application'),
+        {})
+    user = db.relationship('User', back_populates='voterApplication')
+    primary_team = db.relationship('Team')
+    # Loaded with one IN query per list of applications rather than one per row.
+    other_teams = db.relationship('Team', secondary=voter_application_teams, lazy='selectin')
+    consumption_tags = db.relationship('ConsumptionTag', secondary=voter_application_tags, lazy='selectin')
+
+    def __repr__(self):
+        return '<VoterApplication %r %r>' % (self.user_id, self.season)
+
+
 class Team(db.Model):
     __tablename__ = 'team'
     id = db.Column(db.Integer, primary_key=True)
@@ -149,14 +327,25 @@ class Team(db.Model):
     fans = db.relationship('User', backref='flair_team')
 
     def png_url(self, size=30):
-        return "http://cdn-png.si.com//sites/default/files/teams/basketball/cbk/logos/%s_%s.png" % (self.png_name, size)
+        return png_url(self, size)
 
     def logo_html(self, size=30):
-        if size == 30 or size == 23:
-            return "<span class=logo%s><img src='%s' class='logo%s-%s' alt=\"%s Logo\"></span>" % \
-                   (size, url_for('static', filename='img/logos_%s.png' % size), size, self.png_name, self.full_name)
-        else:
-            return "<img src='%s' alt='%s Logo'>" % (self.png_url(size), self.full_name)
+        return render_logo(self, size)
+
+    def __commit_insert__(self):
+        invalidate_team_index()
+        invalidate_pages()
+        invalidate_users()
+
+    def __commit_update__(self):
+        invalidate_team_index()
+        invalidate_pages()
+        invalidate_users()
+
+    def __commit_delete__(self):
+        invalidate_team_index()
+        invalidate_pages()
+        invalidate_users()
 
     def __repr__(self):
         if self.short_name:
@@ -181,6 +370,15 @@ class Conference(db.Model):
     games = db.relationship('Game', backref='conference')
     status = db.Column(db.String(30))
 
+    def __commit_insert__(self):
+        invalidate_pages()
+
+    def __commit_update__(self):
+        invalidate_pages()
+
+    def __commit_delete__(self):
+        invalidate_pages()
+
 
 class Game(db.Model):
     __tablename__ = 'game'
@@ -199,14 +397,88 @@ class Game(db.Model):
     home_team = db.relationship('Team', foreign_keys=[home_team_id])
     away_team = db.relationship('Team', foreign_keys=[away_team_id])
 
+    # A game can move between conferences, so drop every cached bracket.
+    # Changing a game can also strand picks already made, so check them,
+    # once per conference however many games the commit touched.
+    def __commit_insert__(self):
+        forget_bracket()
+        after_commit(audit_conference, self.conference_id)
+
+    def __commit_update__(self):
+        forget_bracket()
+        if self.__dict__.pop('_repriced', False):
+            after_commit(score_conference, self.conference_id)
+        after_commit(audit_conference, self.conference_id)
+
+    def __commit_delete__(self):
+        forget_bracket()
+        after_commit(audit_conference, self.conference_id)
+
 
 class Result(db.Model):
     __tablename = 'result'
     id = db.Column(db.Integer, primary_key=True)
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
+    # Keep the replaced game in the history, so moving a result can rescore
+    # the conference it came from.
+    game_id = db.column_property(db.Column(db.Integer, db.ForeignKey('game.id')), active_history=True)
     winning_team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     game = db.relationship('Game', back_populates='result')
 
+    # Scores change per result, but the leaderboard is ranked once per
+    # commit, so entering a whole round of results re-ranks it once.
+    def __commit_insert__(self):
+        conference_id = conference_of_game(self.game_id)
+        forget_bracket(conference_id)
+        score_result(self.game_id, self.winning_team_id)
+        after_commit(refresh_leaderboard, conference_id)
+
+    def __commit_update__(self):
+        conference_id = conference_of_game(self.game_id)
+        forget_bracket(conference_id)
+        after_commit(score_conference, conference_id)
+        moved_from = conference_of_game(self.__dict__.pop('_moved_from_game', None))
+        if moved_from is not None and moved_from != conference_id:
+            forget_bracket(moved_from)
+            after_commit(score_conference, moved_from)
+
+    def __commit_delete__(self):
+        conference_id = conference_of_game(self.game_id)
+        forget_bracket(conference_id)
+        after_commit(score_conference, conference_id)
+
+
+@event.listens_for(Result, 'before_update')
+def remember_moved_result(mapper, connection, result):
+    # Commit hooks run after the flush has cleared the history.
+    replaced = inspect(result).attrs.game_id.history.deleted
+    if replaced and replaced[0] is not None:
+        result._moved_from_game = replaced[0]
+
+
+@event.listens_for(Game, 'before_update')
+def remember_repriced_game(mapper, connection, game):
+    if inspect(game).attrs.point_value.history.has_changes():
+        game._repriced = True
+
+
+class Job(db.Model):
+    __tablename__ = 'job'
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(50))
+    payload = db.Column(db.Text)
+    status = db.Column(db.Enum('pending', 'running', 'done', 'failed'), default='pending')
+    attempts = db.Column(db.Integer, default=0)
+    last_error = db.Column(db.Text)
+    progress = db.Column(db.Text)
+    run_after = db.Column(db.DateTime)
+    created = db.Column(db.DateTime)
+    updated = db.Column(db.DateTime)
+    __table_args__ = (
+        Index('ix_job_status_run_after', 'status', 'run_after'),
+        # Counts recent starts of rate limited tasks.
+        Index('ix_job_task_updated', 'task', 'updated'),
+        {})
+
 
 class Prediction(db.Model):
     __tablename__ = 'prediction'
@@ -215,5 +487,165 @@ class Prediction(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     winning_team_id = db.Column(db.Integer, db.ForeignKey('team.id'))
     game = db.relationship('Game', backref='predictions')
+    __table_args__ = (
+        Index('ix_prediction_user_game', 'user_id', 'game_id', unique=True),
+        {})
 
 
+class Score(db.Model):
+    __tablename__ = 'score'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    conference_id = db.Column(db.Integer, db.ForeignKey('conference.id'), nullable=False)
+    points = db.Column(db.Float, default=0, nullable=False)
+    max_remaining = db.Column(db.Float, default=0, nullable=False)
+    rank = db.Column(db.Integer)
+    position = db.Column(db.Integer)
+    __table_args__ = (
+        UniqueConstraint('user_id', 'conference_id', name='one_score'),
+        Index('ix_score_conference_position', 'conference_id', 'position'),
+        Index('ix_score_conference_points', 'conference_id', 'points'),
+        {})
+    user = db.relationship('User', back_populates='ballots')
+    conference = db.relationship('Conference')
+
+
+# Scoring runs from the models_committed signal, after the session's
+# transaction has finished, so it talks to the engine directly instead of
+# going through db.session.
+
+def walk_bracket(games):
+    """Yield games so that each game comes after the games feeding into it.
+
+    Follows next_game_id from the championship down, visiting every game
+    exactly once.
+    """
+    by_id = dict((game.id, game) for game in games)
+    feeders = {}
+    for game in games:
+        feeders.setdefault(game.next_game_id, []).append(game)
+    roots = [game for game in games if game.next_game_id not in by_id]
+    stack = [(game, False) for game in roots]
+    while stack:
+        game, expanded = stack.pop()
+        if expanded:
+            yield game
+            continue
+        stack.append((game, True))
+        stack.extend((feeder, False) for feeder in feeders.get(game.id, ()))
+
+
+def forget_bracket(conference_id=None):
+    from projections import invalidate_bracket
+    from whatif import invalidate_contenders
+    invalidate_bracket(conference_id)
+    invalidate_contenders(conference_id)
+
+
+def audit_conference(conference_id):
+    if conference_id is None:
+        return
+    from projections import audit_after_edit
+    audit_after_edit(conference_id)
+
+
+def conference_of_game(game_id):
+    if game_id is None:
+        return None
+    return db.engine.execute(
+        select([Game.conference_id]).where(Game.id == game_id)).scalar()
+
+
+def score_conference(conference_id):
+    """Rescore every bracket in a conference from scratch."""
+    if conference_id is None:
+        return
+    from projections import load_bracket, load_picks, project
+    with db.engine.begin() as conn:
+        bracket = load_bracket(conference_id, conn)
+        user_ids, picks = load_picks(bracket, conference_id, conn)
+        points, _, _ = project(bracket, picks)
+        conn.execute(Score.__table__.delete().where(Score.conference_id == conference_id))
+        if len(user_ids):
+            conn.execute(Score.__table__.insert(),
+                         [dict(user_id=user_id, conference_id=conference_id, points=total, max_remaining=0)
+                          for user_id, total in zip(user_ids.tolist(), points.tolist())])
+    after_commit(refresh_leaderboard, conference_id)
+
+
+def score_result(game_id, winning_team_id):
+    """Credit a single new result to the users who picked it correctly.
+
+    A result without a winner counts as unplayed, as it does everywhere
+    else, so it credits nobody.
+    """
+    if winning_team_id is None:
+        return None
+    game = db.engine.execute(select([Game.conference_id, Game.point_value])
+                             .where(Game.id == game_id)).first()
+    if game is None:
+        return None
+    pickers = select([Prediction.user_id]).where(
+        (Prediction.game_id == game_id) & (Prediction.winning_team_id == winning_team_id))
+    unscored = select([Prediction.user_id]).where(Prediction.game_id == game_id).where(~exists().where(
+        (Score.user_id == Prediction.user_id) & (Score.conference_id == game.conference_id)))
+    with db.engine.begin() as conn:
+        conn.execute(Score.__table__.insert().from_select(
+            ['user_id', 'conference_id', 'points'],
+            unscored.with_only_columns([Prediction.user_id, literal(game.conference_id), literal(0)])))
+        conn.execute(Score.__table__.update()
+                     .where(Score.conference_id == game.conference_id)
+                     .where(Score.user_id.in_(pickers))
+                     .values(points=Score.points + (game.point_value or 0)))
+    return game.conference_id
+
+
+def eliminated_teams(games, winners):
+    """Return the ids of teams that have lost a game in the bracket."""
+    feeders = dict(((game.next_game_id, game.winner_is_home), game.id) for game in games)
+    eliminated = set()
+    for game in walk_bracket(games):
+        if game.id not in winners:
+            continue
+        home = game.home_team_id or winners.get(feeders.get((game.id, True)))
+        away = game.away_team_id or winners.get(feeders.get((game.id, False)))
+        eliminated.update(team for team in (home, away) if team and team != winners[game.id])
+    return eliminated
+
+
+def refresh_leaderboard(conference_id):
+    """Recompute max remaining points, rank and position for a conference.
+
+    Max remaining points come from projections.project.  Ties are listed in
+    the order the brackets arrived, as submit_bracket places them.  Only
+    rows whose values changed are written back, so a result that reshuffles
+    a handful of users costs a handful of UPDATEs.
+    """
+    if conference_id is None:
+        return
+    from projections import load_bracket, load_picks, project
+    table = Score.__table__
+    with db.engine.begin() as conn:
+        bracket = load_bracket(conference_id, conn)
+        user_ids, picks = load_picks(bracket, conference_id, conn)
+        _, remaining, _ = project(bracket, picks)
+        max_remaining = dict(zip(user_ids.tolist(), remaining.tolist()))
+
+        rows = conn.execute(select([table.c.id, table.c.user_id, table.c.points, table.c.max_remaining,
+                                    table.c.rank, table.c.position])
+                            .where(table.c.conference_id == conference_id)
+                            .order_by(desc(table.c.points), table.c.id)).fetchall()
+        changed = []
+        rank = 0
+        previous = None
+        for position, row in enumerate(rows, 1):
+            if row.points != previous:
+                rank, previous = position, row.points
+            left = max_remaining.get(row.user_id) or 0
+            if (row.rank, row.position, row.max_remaining) != (rank, position, left):
+                changed.append(dict(_id=row.id, rank=rank, position=position, max_remaining=left))
+        if changed:
+            conn.execute(table.update().where(table.c.id == bindparam('_id'))
+                         .values(rank=bindparam('rank'), position=bindparam('position'),
+                                 max_remaining=bindparam('max_remaining')),
+                         changed)
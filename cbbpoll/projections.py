@@ -0,0 +1,190 @@
+"""Vectorized bracket projections.
+
+Every bracket in a conference is encoded as one row of a users x games
+matrix of picked team ids, so scoring and elimination for all users is a
+handful of NumPy operations instead of a loop over Prediction rows.
+
+Bracket structure and results are cached per conference and dropped by the
+Game and Result commit hooks in models.
+"""
+from itertools import chain
+from threading import Lock
+from time import time
+import numpy as np
+from sqlalchemy import select, func
+from cbbpoll import app, db
+from decorators import queued
+from models import Game, Result, Prediction, walk_bracket, eliminated_teams
+
+NO_PICK = -1
+UNPLAYED = -2
+# Other processes only learn about commits through this expiry, so only
+# read-only pages use the cache; writes that depend on it use read_bracket.
+BRACKET_TTL = 60
+
+_brackets = {}
+_brackets_lock = Lock()
+
+
+class Bracket(object):
+    """Games of a conference as arrays, in walk_bracket order.
+
+    home_source[j] and away_source[j] are the columns of the games feeding
+    game j, or -1 where the slot holds a fixed team (home_team, away_team).
+    Instances are shared between requests, so the arrays are read-only.
+    """
+    __slots__ = ('game_ids', 'home_source', 'away_source', 'home_team', 'away_team',
+                 'points', 'winners', 'played', 'eliminated', '_sorter')
+
+    def __init__(self, games, winners):
+        games = list(walk_bracket(games))
+        column = dict((game.id, j) for j, game in enumerate(games))
+        sources = dict(((game.next_game_id, game.winner_is_home), column[game.id]) for game in games)
+        self.game_ids = np.array([game.id for game in games], dtype=np.int64)
+        self.home_source = np.array([sources.get((game.id, True), -1) for game in games], dtype=np.int64)
+        self.away_source = np.array([sources.get((game.id, False), -1) for game in games], dtype=np.int64)
+        self.home_team = np.array([game.home_team_id or NO_PICK for game in games], dtype=np.int64)
+        self.away_team = np.array([game.away_team_id or NO_PICK for game in games], dtype=np.int64)
+        self.points = np.array([game.point_value or 0 for game in games], dtype=np.float64)
+        self.winners = np.array([winners.get(game.id, UNPLAYED) for game in games], dtype=np.int64)
+        self.played = self.winners != UNPLAYED
+        self.eliminated = np.array(sorted(eliminated_teams(games, winners)), dtype=np.int64)
+        self._sorter = np.argsort(self.game_ids)
+        for name in self.__slots__:
+            getattr(self, name).flags.writeable = False
+
+    def __len__(self):
+        return len(self.game_ids)
+
+    def columns(self, game_ids):
+        """Map game ids to their column in the picks matrix."""
+        positions = np.searchsorted(self.game_ids, game_ids, sorter=self._sorter)
+        return self._sorter[positions]
+
+    @property
+    def team_ids(self):
+        """Ids of the teams seeded into the bracket."""
+        teams = np.concatenate([self.home_team, self.away_team])
+        return np.unique(teams[teams != NO_PICK])
+
+
+def load_bracket(conference_id, conn=None):
+    """Return the cached Bracket for a conference, reading it if needed."""
+    cached = _brackets.get(conference_id)
+    if cached and cached[0] > time():
+        return cached[1]
+    bracket = read_bracket(conference_id, conn)
+    with _brackets_lock:
+        _brackets[conference_id] = (time() + BRACKET_TTL, bracket)
+    return bracket
+
+
+def invalidate_bracket(conference_id=None):
+    """Forget one conference's cached Bracket, or all of them."""
+    with _brackets_lock:
+        if conference_id is None:
+            _brackets.clear()
+        else:
+            _brackets.pop(conference_id, None)
+
+
+def read_bracket(conference_id, conn=None):
+    conn = conn or db.engine
+    games = conn.execute(select([Game.id, Game.next_game_id, Game.winner_is_home, Game.point_value,
+                                 Game.home_team_id, Game.away_team_id])
+                         .where(Game.conference_id == conference_id)).fetchall()
+    winners = dict(conn.execute(select([Result.game_id, Result.winning_team_id])
+                                .select_from(Result.__table__.join(Game.__table__))
+                                .where(Game.conference_id == conference_id)
+                                .where(Result.winning_team_id != None)).fetchall())
+    return Bracket(games, winners)
+
+
+def load_picks(bracket, conference_id, conn=None):
+    """Return (user_ids, picks) where picks[i, j] is user i's team for game j."""
+    conn = conn or db.engine
+    result = conn.execute(select([Prediction.user_id, Prediction.game_id,
+                                  func.coalesce(Prediction.winning_team_id, NO_PICK)])
+                          .select_from(Prediction.__table__.join(Game.__table__))
+                          .where(Game.conference_id == conference_id))
+    # Plain integer columns need no result processing, and skipping it
+    # matters with a row per user per game.
+    rows = result.cursor.fetchall()
+    result.close()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros((0, len(bracket)), dtype=np.int64)
+    data = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+    user_ids, rows = np.unique(data[:, 0], return_inverse=True)
+    picks = np.full((len(user_ids), len(bracket)), NO_PICK, dtype=np.int64)
+    picks[rows, bracket.columns(data[:, 1])] = data[:, 2]
+    return user_ids, picks
+
+
+def invalid_picks(bracket, picks):
+    """Flag the picks that break their bracket, for every row of picks at once.
+
+    A pick is valid when it is one of the two teams the bracket itself
+    sends to the game: a fixed team or the same row's pick for the feeding
+    game.  Missing picks are invalid too.  Returns a boolean array shaped
+    like picks.
+    """
+    home = np.where(bracket.home_source >= 0, picks[:, bracket.home_source], bracket.home_team)
+    away = np.where(bracket.away_source >= 0, picks[:, bracket.away_source], bracket.away_team)
+    return (picks == NO_PICK) | ((picks != home) & (picks != away))
+
+
+def bracket_errors(bracket, picks):
+    """Check one bracket, given as team ids in column order."""
+    picks = np.asarray(picks, dtype=np.int64).reshape(1, len(bracket))
+    errors = []
+    for j in np.flatnonzero(invalid_picks(bracket, picks)[0]):
+        if picks[0, j] == NO_PICK:
+            errors.append('Game %d has no pick.' % bracket.game_ids[j])
+        else:
+            errors.append('Team %d can not reach game %d.' % (picks[0, j], bracket.game_ids[j]))
+    return errors
+
+
+def audit_brackets(conference_id):
+    """Check every stored bracket in a conference against its current games.
+
+    Reads the games fresh rather than from the cache, so it can run right
+    after an edit.  Returns (checked, problems) where problems is a list of
+    (user_id, game_ids) for the brackets with invalid or missing picks.
+    """
+    with db.engine.connect() as conn:
+        bracket = read_bracket(conference_id, conn)
+        user_ids, picks = load_picks(bracket, conference_id, conn)
+    bad = invalid_picks(bracket, picks)
+    problems = [(int(user_ids[i]), bracket.game_ids[bad[i]].tolist()) for i in np.flatnonzero(bad.any(axis=1))]
+    return len(user_ids), problems
+
+
+@queued
+def audit_after_edit(conference_id):
+    checked, problems = audit_brackets(conference_id)
+    if problems:
+        app.logger.warning('%d of %d brackets in conference %s no longer fit its games; see %s',
+                           len(problems), checked, conference_id, '/audit/%s' % conference_id)
+
+
+def project(bracket, picks):
+    """Score every bracket and bound what it can still earn.
+
+    Returns (points, max_remaining, out_of_reach) arrays with one entry per
+    row of picks.  A pick on a team that has already lost is void for every
+    game after that loss.  A user is out of reach once even a perfect run
+    of their live picks can't reach the leader's current points.  That is
+    only a loose test of elimination: it ignores what the leader can still
+    earn, so some users who pass it can no longer win.  whatif.contenders
+    gives the exact answer.
+    """
+    correct = (picks == bracket.winners) & bracket.played
+    points = correct.dot(bracket.points)
+    live = ~bracket.played & (picks != NO_PICK) & ~np.isin(picks, bracket.eliminated)
+    max_remaining = live.dot(bracket.points)
+    if len(points):
+        out_of_reach = points + max_remaining < points.max()
+    else:
+        out_of_reach = np.zeros(0, dtype=bool)
+    return points, max_remaining, out_of_reach
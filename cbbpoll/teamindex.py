@@ -0,0 +1,98 @@
+"""Process-wide, read-only index of the Team table.
+
+There are only a few hundred teams and they almost never change, so the
+whole table is kept in memory with logo HTML rendered up front.  Sprite
+URLs depend on the request, so the HTML is kept split around them and
+joined at render time; building the index needs no request context.  The
+index is replaced wholesale, never mutated, so readers don't need a lock.
+Team commit hooks in models throw it away; other processes pick up changes
+when it expires.
+"""
+from collections import namedtuple
+from threading import Lock
+from time import time
+from flask import url_for
+
+LOGO_SIZES = (23, 30, 40, 80)
+SPRITE_SIZES = (23, 30)
+TEAM_INDEX_TTL = 300
+
+_index = [None]
+_index_lock = Lock()
+
+
+def png_url(team, size=30):
+    return "http://cdn-png.si.com//sites/default/files/teams/basketball/cbk/logos/%s_%s.png" % (team.png_name, size)
+
+
+def logo_parts(team, size=30):
+    """Return logo HTML as (before, after) the sprite URL; after is None
+    for sizes that don't use a sprite."""
+    if size in SPRITE_SIZES:
+        return ("<span class=logo%s><img src='" % size,
+                "' class='logo%s-%s' alt=\"%s Logo\"></span>" % (size, team.png_name, team.full_name))
+    else:
+        return "<img src='%s' alt='%s Logo'>" % (png_url(team, size), team.full_name), None
+
+
+def join_logo(parts, size):
+    before, after = parts
+    if after is None:
+        return before
+    return before + url_for('static', filename='img/logos_%s.png' % size) + after
+
+
+def render_logo(team, size=30):
+    return join_logo(logo_parts(team, size), size)
+
+
+class TeamInfo(namedtuple('TeamInfo', 'id full_name short_name flair nickname png_name conference logos')):
+    """Immutable stand-in for a Team row."""
+    __slots__ = ()
+
+    def png_url(self, size=30):
+        return png_url(self, size)
+
+    def logo_html(self, size=30):
+        return join_logo(self.logos.get(size) or logo_parts(self, size), size)
+
+    def __str__(self):
+        if self.short_name:
+            return'%s (%s)' % (self.short_name, self.full_name)
+        else:
+            return self.full_name
+
+
+class TeamIndex(object):
+    __slots__ = ('teams', 'by_id', 'by_flair', 'expires')
+
+    def __init__(self, rows):
+        teams = []
+        for row in rows:
+            logos = dict((size, logo_parts(row, size)) for size in LOGO_SIZES)
+            teams.append(TeamInfo(row.id, row.full_name, row.short_name, row.flair, row.nickname,
+                                  row.png_name, row.conference, logos))
+        self.teams = tuple(sorted(teams, key=lambda team: team.full_name))
+        self.by_id = dict((team.id, team) for team in teams)
+        self.by_flair = dict((team.flair, team) for team in teams if team.flair)
+        self.expires = time() + TEAM_INDEX_TTL
+
+    def logo_html(self, team_id, size=30):
+        team = self.by_id.get(team_id)
+        return team.logo_html(size) if team else ''
+
+
+def team_index():
+    """Return the current TeamIndex, building it on first use."""
+    index = _index[0]
+    if index is None or index.expires < time():
+        from models import Team
+        with _index_lock:
+            index = _index[0]
+            if index is None or index.expires < time():
+                index = _index[0] = TeamIndex(Team.query.all())
+    return index
+
+
+def invalidate_team_index():
+    _index[0] = None
@@ -0,0 +1,72 @@
+"""Short-lived cache of logged-in users for Flask-Login's user_loader.
+
+Every authenticated request needs its User, and most pages then touch the
+flair team.  Snapshots of both are loaded with one joined query in a
+private session and kept detached in a per-process LRU for USER_CACHE_TTL
+seconds.  Each request gets its own copy by merging the snapshot into
+db.session with load=False, which runs no SQL and never changes the
+snapshot, so requests can't see each other's edits.
+
+User commit hooks and the bulk User updates in models, admin and
+botactions drop entries; Team hooks drop them all, since snapshots carry
+the flair team.  Other processes catch up when entries expire.  Set
+USER_CACHE_TTL to 0 to load the user on every request instead.
+"""
+from threading import Lock
+from time import time
+from sqlalchemy.orm import Session, joinedload
+from cbbpoll import app, db
+from cache import LRUCache
+
+_store = [None]
+_store_lock = Lock()
+
+
+def user_cache():
+    """This process's snapshot store, or None when caching is off."""
+    if _store[0] is None:
+        with _store_lock:
+            if _store[0] is None:
+                if app.config.get('USER_CACHE_TTL', 30):
+                    _store[0] = LRUCache(app.config.get('USER_CACHE_SIZE', 1024))
+                else:
+                    _store[0] = False
+    return _store[0] or None
+
+
+def _snapshot(user_id):
+    from models import User
+    session = Session(bind=db.engine)
+    try:
+        user = session.query(User).options(joinedload(User.flair_team)).get(user_id)
+        session.expunge_all()
+        return user
+    finally:
+        session.close()
+
+
+def cached_user(user_id):
+    """Return the User with id user_id in db.session, or None if there isn't one."""
+    store = user_cache()
+    if store is None:
+        from models import User
+        return User.query.get(user_id)
+    entry = store.get(user_id)
+    if entry is None or entry[0] < time():
+        entry = (time() + app.config.get('USER_CACHE_TTL', 30), _snapshot(user_id))
+        store.set(user_id, entry)
+    if entry[1] is None:
+        return None
+    return db.session.merge(entry[1], load=False)
+
+
+def invalidate_users(user_ids=None):
+    """Drop the snapshots of user_ids, or of every user when None."""
+    store = user_cache()
+    if store is None:
+        return
+    if user_ids is None:
+        store.clear()
+    else:
+        for user_id in user_ids:
+            store.delete(user_id)
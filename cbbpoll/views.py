@@ -1,18 +1,37 @@
 from praw import Reddit
-from flask import render_template, flash, redirect, session, url_for, request, g, abort, jsonify
+from flask import render_template, flash, redirect, session, url_for, request, g, abort, jsonify, \
+    Response, stream_with_context
 from flask_login import login_user, logout_user, current_user, login_required
 from cbbpoll import app, db, lm, admin, message
-from forms import EditProfileForm
-from models import User, Team, Conference
+from forms import EditProfileForm, VoterApplicationForm
+from models import User, Team, Conference, Score, Prediction, VoterApplication, users_by_conference
+from projections import load_bracket, read_bracket, bracket_errors, audit_brackets, NO_PICK
+from whatif import simulate, load_contenders, invalidate_contenders
+from teamindex import team_index
 from datetime import datetime
 from pytz import utc, timezone
-from botactions import update_flair
+from botactions import update_flair, flair_progress
+from decorators import cached_for_anonymous
+from export import export_lines, FORMATS
+from usercache import cached_user
 import re
 from jinja2 import evalcontextfilter, Markup, escape
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy import or_, func, case
+from sqlalchemy.orm import joinedload
 
 eastern_tz = timezone('US/Eastern')
 
+LEADERBOARD_PAGE_SIZE = 50
+USER_PAGE_SIZE = 100
+BRACKET_PAGE_SIZE = 10
+
+USER_FILTERS = {
+    'flagged': lambda: User.applicationFlag == True,
+    'voters': lambda: User.is_voter == True,
+    'whatif': lambda: or_(User.is_voter == True, User.applicationFlag == True),
+}
+
 _paragraph_re = re.compile(r'(?:\r\n|\r|\n){2,}')
 
 
@@ -40,7 +59,7 @@ def before_request():
 
 @lm.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return cached_user(int(id))
 
 
 @app.errorhandler(403)
@@ -60,6 +79,7 @@ def internal_error(error):
 
 
 @app.route('/')
+@cached_for_anonymous
 def index():
     user = g.user
 
@@ -107,7 +127,7 @@ def authorized():
         remember_me = session['remember_me']
         session.pop('remember_me', None)
     login_user(user, remember=remember_me)
-    update_flair(user, r.user.me())
+    update_flair(user.id, reddit_user.name)
     return redirect(next_path or url_for('index'))
 
 
@@ -146,8 +166,12 @@ def user(nickname, page=1):
     if user is None:
         flash('User ' + nickname + ' not found.', 'warning')
         return redirect(url_for('index'))
+    ballots = user.ballots.options(joinedload(Score.conference)) \
+        .paginate(page, BRACKET_PAGE_SIZE, False)
     return render_template('user.html',
                            user=user,
+                           ballots=ballots,
+                           application=user.voterApplication.get(app.config['SEASON']),
                            title=nickname)
 
 
@@ -207,19 +231,102 @@ def retry_confirm():
         flash('Your email address has been confirmed.', 'success')
         return redirect(url_for('index'))
     token = current_user.generate_confirmation_token()
-    message.send_email('Confirm Your Account', [current_user], 'confirmation', token=token)
+    message.send_email('Confirm Your Account', [current_user.email], 'confirmation', user=current_user, token=token)
     flash('A new confirmation email has been sent to you. Please check your spam or junk folder.', 'info')
     return redirect(url_for('index'))
 
 
+@app.route('/api/bracket/<int:conference_id>', methods=['POST'])
+@login_required
+def submit_bracket(conference_id):
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('picks'), dict):
+        return jsonify(errors=['Expected a JSON object with a "picks" mapping of game id to team id.']), 400
+    # Read fresh rather than from the cache: another process may have
+    # recorded the first result less than BRACKET_TTL seconds ago.
+    bracket = read_bracket(conference_id)
+    if not len(bracket):
+        abort(404)
+    if bracket.played.any():
+        return jsonify(errors=['This tournament has already started.']), 409
+    try:
+        picked = dict((int(game_id), int(team_id)) for game_id, team_id in data['picks'].items())
+    except (TypeError, ValueError):
+        return jsonify(errors=['Game and team ids must be integers.']), 400
+    unknown = set(picked) - set(bracket.game_ids.tolist())
+    if unknown:
+        return jsonify(errors=['Game %d is not in this tournament.' % game_id for game_id in sorted(unknown)]), 400
+    picks = [picked.get(game_id, NO_PICK) for game_id in bracket.game_ids.tolist()]
+    errors = bracket_errors(bracket, picks)
+    if errors:
+        return jsonify(errors=errors), 400
+
+    # The old picks are replaced in one transaction.  Two submissions racing
+    # for the same user trip the unique index on (user_id, game_id); the
+    # loser retries once, replacing the winner's picks with its own.
+    for _ in range(2):
+        try:
+            Prediction.query.filter(Prediction.user_id == g.user.id) \
+                .filter(Prediction.game_id.in_(bracket.game_ids.tolist())) \
+                .delete(synchronize_session=False)
+            db.session.bulk_insert_mappings(Prediction, [
+                dict(user_id=g.user.id, game_id=game_id, winning_team_id=team_id)
+                for game_id, team_id in zip(bracket.game_ids.tolist(), picks)])
+            if not Score.query.filter_by(user_id=g.user.id, conference_id=conference_id).first():
+                score = Score(user_id=g.user.id, conference_id=conference_id, points=0, rank=1,
+                              max_remaining=float(bracket.points.sum()))
+                db.session.add(score)
+                db.session.flush()
+                # Nobody has scored before the first result, so everyone ties
+                # for first and the leaderboard lists brackets as they arrived.
+                score.position = Score.query.filter(Score.conference_id == conference_id) \
+                    .filter(Score.id <= score.id).count()
+            db.session.commit()
+            break
+        except IntegrityError:
+            db.session.rollback()
+    else:
+        return jsonify(errors=['Your bracket was being saved by another request; please try again.']), 409
+    invalidate_contenders(conference_id)
+    return jsonify(saved=len(picks))
+
+
 @app.route('/teams')
+@cached_for_anonymous
 def teams():
-    teams = Team.query.all()
+    teams = team_index().teams
     return render_template('teams.html',
                            title='Teams',
                            teams=teams)
 
 
+@app.route('/leaderboard/<int:conference_id>')
+@app.route('/leaderboard/<int:conference_id>/')
+@app.route('/leaderboard/<int:conference_id>/<int:page>')
+@app.route('/leaderboard/<int:conference_id>/<int:page>/')
+def leaderboard(conference_id, page=1):
+    conference = Conference.query.get_or_404(conference_id)
+    first = (page - 1) * LEADERBOARD_PAGE_SIZE + 1
+    last = page * LEADERBOARD_PAGE_SIZE
+    scores = Score.query.options(joinedload(Score.user)) \
+        .filter(Score.conference_id == conference_id) \
+        .filter(Score.position.between(first, last)) \
+        .order_by(Score.position).all()
+    if not scores and page != 1:
+        abort(404)
+    has_next = db.session.query(Score.id).filter(Score.conference_id == conference_id) \
+        .filter(Score.position == last + 1).first() is not None
+    leader_points = db.session.query(Score.points).filter(Score.conference_id == conference_id) \
+        .filter(Score.position == 1).scalar()
+    return render_template('leaderboard.html',
+                           title='%s Leaderboard' % conference.name,
+                           conference=conference,
+                           scores=scores,
+                           page=page,
+                           has_next=has_next,
+                           leader_points=leader_points)
+
+
 @app.route('/about')
 def about():
     return render_template('about.html', title='About')
@@ -228,7 +335,7 @@ def about():
 @app.route('/apply', methods=['GET', 'POST'])
 @login_required
 def apply():
-    application = VoterApplication.query.filter_by(user_id=g.user.id).filter_by(season=app.config['SEASON']).first()
+    application = g.user.voterApplication.get(app.config['SEASON'])
     if application:
         flash("Application Already Submitted", 'info')
         return redirect(url_for('index'))
@@ -257,24 +364,173 @@ def apply():
                            form=form)
 
 
+def filtered_users(flag):
+    query = User.query
+    if flag in USER_FILTERS:
+        query = query.filter(USER_FILTERS[flag]())
+    return query
+
+
+def in_conference(query, conference):
+    if conference:
+        return query.filter(Team.conference == conference)
+    return query.filter(or_(Team.conference == None, Team.conference == ''))
+
+
+def render_user_listing(title, flag):
+    counts = filtered_users(flag).outerjoin(User.flair_team).with_entities(
+        Team.conference,
+        func.count(User.id),
+        func.sum(case([(User.applicationFlag == True, 1)], else_=0)),
+        func.sum(case([(User.is_voter == True, 1)], else_=0)),
+        func.sum(case([(USER_FILTERS['whatif'](), 1)], else_=0))) \
+        .group_by(Team.conference).order_by(Team.conference)
+    if 'conference' in request.args:
+        counts = in_conference(counts, request.args['conference'])
+    return render_template('users.html',
+                           title=title,
+                           flag=flag,
+                           conferences=counts.all(),
+                           page_size=USER_PAGE_SIZE)
+
+
 @app.route('/users')
 def users():
     if not current_user.is_admin():
         abort(403)
-    users = User.query
-    return render_template('users.html',
-                           title='All Users',
-                           users=users)
+    flag = request.args.get('flag')
+    return render_user_listing('All Users', flag if flag in USER_FILTERS else None)
 
 
 @app.route('/whatif')
 def whatif():
     if not current_user.is_admin():
         abort(403)
-    users = User.query.filter((User.is_voter == True) | (User.applicationFlag == True))
-    return render_template('users.html',
-                           title='What if Voters',
-                           users=users)
+    return render_user_listing('What if Voters', 'whatif')
+
+
+@app.route('/_users')
+def _users():
+    if not current_user.is_admin():
+        abort(403)
+    try:
+        after = int(request.args.get('after', 0))
+        limit = min(max(int(request.args.get('limit', USER_PAGE_SIZE)), 1), 1000)
+    except ValueError:
+        abort(400)
+    query = users_by_conference(filtered_users(request.args.get('flag')))
+    if 'conference' in request.args:
+        query = in_conference(query, request.args['conference'])
+    page = query.filter(User.id > after).order_by(User.id).limit(limit + 1).all()
+    more = len(page) > limit
+    page = page[:limit]
+    return jsonify(users=[dict(id=user.id,
+                               nickname=user.nickname,
+                               conference=user.conference,
+                               html=user.name_with_flair(23),
+                               url=url_for('user', nickname=user.nickname),
+                               is_voter=bool(user.is_voter),
+                               flagged=bool(user.applicationFlag))
+                          for user in page],
+                   after=page[-1].id if more else None)
+
+
+@app.route('/contenders/<int:conference_id>')
+def contenders_page(conference_id):
+    conference = Conference.query.get_or_404(conference_id)
+    try:
+        games, ranked = load_contenders(conference_id)
+    except ValueError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('leaderboard', conference_id=conference_id))
+    users = dict((user.id, user) for user in User.query
+                 .filter(User.id.in_([contender.user_id for contender in ranked]))) if ranked else {}
+    teams = team_index().by_id
+    rows = []
+    for contender in ranked:
+        if contender.user_id in users:
+            needs = [teams[next(iter(winners))] for winners in contender.needs
+                     if len(winners) == 1 and next(iter(winners)) in teams]
+            rows.append((users[contender.user_id], len(contender.outcomes), needs))
+    return render_template('contenders.html',
+                           title='Who Can Still Win: %s' % conference.name,
+                           conference=conference,
+                           outcomes=2 ** len(games),
+                           rows=rows)
+
+
+@app.route('/audit/<int:conference_id>')
+def audit(conference_id):
+    if not current_user.is_admin():
+        abort(403)
+    conference = Conference.query.get_or_404(conference_id)
+    checked, problems = audit_brackets(conference_id)
+    users = dict((user.id, user) for user in User.query
+                 .filter(User.id.in_([user_id for user_id, _ in problems]))) if problems else {}
+    return render_template('audit.html',
+                           title='Bracket Audit: %s' % conference.name,
+                           conference=conference,
+                           checked=checked,
+                           problems=[(users.get(user_id), user_id, game_ids) for user_id, game_ids in problems])
+
+
+@app.route('/export/brackets.<format>')
+def export_brackets(format):
+    if not current_user.is_admin():
+        abort(403)
+    if format not in FORMATS:
+        abort(404)
+    conference_id = request.args.get('conference', type=int)
+    filename = 'brackets-%s.%s' % (conference_id or 'all', format)
+    return Response(stream_with_context(export_lines(format, conference_id)),
+                    mimetype=FORMATS[format],
+                    headers={'Content-Disposition': 'attachment; filename=%s' % filename})
+
+
+@app.route('/whatif/<int:conference_id>', methods=['GET', 'POST'])
+def whatif_simulation(conference_id):
+    if not current_user.is_admin():
+        abort(403)
+    conference = Conference.query.get_or_404(conference_id)
+    index = team_index()
+    teams = sorted((index.by_id[team_id] for team_id in load_bracket(conference_id).team_ids.tolist()
+                    if team_id in index.by_id), key=lambda team: team.short_name)
+    strengths = dict((team.id, 1.0) for team in teams)
+    simulations = 10000
+    top_n = 10
+    results = None
+    if request.method == 'POST':
+        try:
+            for team in teams:
+                strengths[team.id] = max(float(request.form.get('team-%d' % team.id, 1)), 0)
+            simulations = min(max(int(request.form.get('simulations', simulations)), 1), 1000000)
+            top_n = max(int(request.form.get('top_n', top_n)), 1)
+        except ValueError:
+            flash('Strengths, simulations and top N must be numbers.', 'danger')
+        else:
+            try:
+                ranked = simulate(conference_id, strengths, simulations=simulations, top_n=top_n)
+            except ValueError as e:
+                flash(str(e), 'danger')
+            else:
+                users = dict((user.id, user) for user in User.query
+                             .filter(User.id.in_([row[0] for row in ranked])))
+                results = [(users[user_id], first, top) for user_id, first, top in ranked if user_id in users]
+    return render_template('whatif.html',
+                           title='What If: %s' % conference.name,
+                           conference=conference,
+                           teams=teams,
+                           strengths=strengths,
+                           simulations=simulations,
+                           top_n=top_n,
+                           results=results)
+
+
+@app.route('/_flair_sync')
+def _flair_sync():
+    if not current_user.is_admin():
+        abort(403)
+    return jsonify(**flair_progress())
 
 
 @app.route('/_flag_user')
@@ -0,0 +1,280 @@
+"""What-if analysis for the games left in a conference tournament.
+
+simulate() plays out the remaining games many times with team strengths
+chosen by an admin.  Team A beats team B with probability
+strength(A) / (strength(A) + strength(B)).  Simulations are generated in
+batches of NumPy arrays and farmed out to a process pool, forked the
+first time a process runs a simulation.  The workers never touch the
+database; everything they need is sent with each task.
+
+contenders() is the exact counterpart for late rounds: it walks every
+remaining outcome and reports who can still finish first.  Its answers are
+cached per conference by load_contenders() and dropped, along with the
+cached bracket, by the Game and Result commit hooks in models.
+"""
+import os
+from multiprocessing import Pool, cpu_count
+from threading import Lock
+from time import time
+import numpy as np
+from cbbpoll import app
+from projections import load_bracket, load_picks, project, NO_PICK, BRACKET_TTL
+
+BATCH_SIZE = 1000
+# contenders() visits up to 2 ** (MAX_ENUMERATED_GAMES + 1) outcome prefixes.
+MAX_ENUMERATED_GAMES = 15
+# Slack for float comparisons of summed point values.
+EPSILON = 1e-9
+# Upper bound on the users x simulations score matrix held at once.
+MAX_CELLS = 1 << 24
+
+_pool = None
+_pool_size = 0
+_pool_pid = None
+_pool_lock = Lock()
+
+_contenders = {}
+_contenders_lock = Lock()
+# Bumped on every invalidation, so an answer computed from data that was
+# replaced meanwhile is returned but not cached.
+_generation = [0]
+_conference_locks = {}
+
+
+def simulate_winners(bracket, strength, count, rng):
+    """Return a (count, games) array of winning team ids.
+
+    strength is indexed by team id.  Games that have already been played
+    keep their actual winner.
+    """
+    winners = np.empty((count, len(bracket)), dtype=np.int64)
+    for j in range(len(bracket)):
+        if bracket.played[j]:
+            winners[:, j] = bracket.winners[j]
+            continue
+        home = winners[:, bracket.home_source[j]] if bracket.home_source[j] >= 0 \
+            else np.repeat(bracket.home_team[j], count)
+        away = winners[:, bracket.away_source[j]] if bracket.away_source[j] >= 0 \
+            else np.repeat(bracket.away_team[j], count)
+        if (home < 0).any() or (away < 0).any():
+            raise ValueError('Game %d has an empty slot' % bracket.game_ids[j])
+        home_strength = strength[home]
+        total = home_strength + strength[away]
+        p_home = np.where(total > 0, home_strength / np.where(total > 0, total, 1), 0.5)
+        winners[:, j] = np.where(rng.random_sample(count) < p_home, home, away)
+    return winners
+
+
+def finishes(bracket, picks, base, winners, top_n):
+    """Count, per user, the simulations they win outright or tie for first
+    in, and the ones they finish in the top top_n.
+    """
+    users = len(base)
+    first = np.zeros(users, dtype=np.int64)
+    top = np.zeros(users, dtype=np.int64)
+    remaining = np.flatnonzero(~bracket.played)
+    chunk = max(1, MAX_CELLS // max(users, 1))
+    kth = users - min(top_n, users)
+    for start in range(0, len(winners), chunk):
+        outcome = winners[start:start + chunk]
+        scores = np.repeat(base[:, None], len(outcome), axis=1)
+        for j in remaining:
+            scores += bracket.points[j] * (picks[:, j][:, None] == outcome[:, j][None, :])
+        first += (scores == scores.max(axis=0)).sum(axis=1)
+        cutoff = np.partition(scores, kth, axis=0)[kth]
+        top += (scores >= cutoff).sum(axis=1)
+    return first, top
+
+
+def get_pool():
+    """This process's simulation workers, forked on first use.
+
+    Returns None when simulations should run in the calling thread.
+    """
+    global _pool, _pool_size, _pool_pid
+    with _pool_lock:
+        if _pool_pid != os.getpid():
+            # A pool inherited through a fork lost its handler threads, so
+            # the child starts its own.
+            _pool, _pool_pid = None, os.getpid()
+            processes = app.config.get('WHATIF_PROCESSES') or cpu_count()
+            if processes > 1:
+                _pool = Pool(processes)
+                _pool_size = processes
+        return _pool
+
+
+def _run_batches(args):
+    (bracket, picks, base, strength, top_n), batches = args
+    first = top = 0
+    for seed, count in batches:
+        winners = simulate_winners(bracket, strength, count, np.random.RandomState(seed))
+        batch_first, batch_top = finishes(bracket, picks, base, winners, top_n)
+        first = first + batch_first
+        top = top + batch_top
+    return first, top
+
+
+def simulate(conference_id, strengths, simulations=10000, top_n=10, seed=None):
+    """Simulate the rest of a conference tournament.
+
+    strengths maps team id to a non-negative strength; teams left out get
+    a strength of 1.  Returns a list of (user_id, p_first, p_top_n) sorted
+    by p_first, best first.
+    """
+    bracket = load_bracket(conference_id)
+    user_ids, picks = load_picks(bracket, conference_id)
+    if not len(user_ids):
+        return []
+    base, _, _ = project(bracket, picks)
+
+    teams = np.concatenate([bracket.home_team, bracket.away_team, picks.ravel(), [0]])
+    strength = np.ones(max(teams.max(), max(strengths or [0])) + 1, dtype=np.float64)
+    for team_id, value in strengths.items():
+        strength[team_id] = max(float(value), 0)
+
+    seed = np.random.randint(1 << 30) if seed is None else seed
+    batches = [(seed + i, min(BATCH_SIZE, simulations - start))
+               for i, start in enumerate(range(0, simulations, BATCH_SIZE))]
+    state = (bracket, picks, base.astype(np.float32), strength, top_n)
+
+    pool = get_pool()
+    if pool is None:
+        results = [_run_batches((state, batches))]
+    else:
+        # One task per worker, so the picks matrix is pickled once per process.
+        chunks = [batches[n::_pool_size] for n in range(_pool_size)]
+        results = pool.map(_run_batches, [(state, chunk) for chunk in chunks if chunk])
+    first = sum(result[0] for result in results)
+    top = sum(result[1] for result in results)
+    ranked = sorted(zip(user_ids.tolist(), (first / float(simulations)).tolist(),
+                        (top / float(simulations)).tolist()),
+                    key=lambda row: (-row[1], -row[2]))
+    return ranked
+
+
+class Contender(object):
+    """A user who finishes first (ties included) in at least one outcome.
+
+    outcomes holds one bitmask per winning outcome, where bit i is set when
+    the home side wins the i-th remaining game.  needs[i] is the set of teams
+    that win the i-th remaining game across those outcomes; a single team
+    means the user needs that team to win it.
+    """
+    __slots__ = ('user_id', 'outcomes', 'needs')
+
+    def __init__(self, user_id, games):
+        self.user_id = user_id
+        self.outcomes = []
+        self.needs = [set() for _ in range(games)]
+
+
+def enumerate_outcomes(bracket, picks, base):
+    """Walk every outcome of the unplayed games of bracket.
+
+    Games are decided in bracket order, so each prefix of outcomes is
+    scored once and shared by every outcome below it.  Users whose best
+    case can't reach the current leader are dropped from a branch as soon
+    as that is known.  Returns (columns, {user index: Contender}).
+    """
+    columns = np.flatnonzero(~bracket.played)
+    if len(columns) > MAX_ENUMERATED_GAMES:
+        raise ValueError('%d games remain; at most %d can be enumerated'
+                         % (len(columns), MAX_ENUMERATED_GAMES))
+    _, bound, _ = project(bracket, picks)
+    winners = bracket.winners.copy()
+    dead = np.zeros(max(picks.max() if picks.size else 0,
+                        bracket.home_team.max(), bracket.away_team.max(), 0) + 2, dtype=bool)
+    dead[bracket.eliminated] = True
+    losses = {}
+    found = {}
+
+    def future_loss(depth, team):
+        # Points at stake on team in the games after depth, for every user.
+        if (depth, team) not in losses:
+            later = columns[depth + 1:]
+            losses[depth, team] = (picks[:, later] == team).dot(bracket.points[later])
+        return losses[depth, team]
+
+    def visit(depth, mask, active, partial, bound):
+        if depth == len(columns):
+            leaders = active[partial >= partial.max() - EPSILON]
+            outcome = winners[columns]
+            for user in leaders:
+                contender = found.get(user)
+                if contender is None:
+                    contender = found[user] = Contender(user, len(columns))
+                contender.outcomes.append(mask)
+                for needed, team in zip(contender.needs, outcome):
+                    needed.add(team)
+            return
+        j = columns[depth]
+        home = winners[bracket.home_source[j]] if bracket.home_source[j] >= 0 else bracket.home_team[j]
+        away = winners[bracket.away_source[j]] if bracket.away_source[j] >= 0 else bracket.away_team[j]
+        pick = picks[active, j]
+        live = (pick != NO_PICK) & ~dead[pick]
+        settled = bound - bracket.points[j] * live
+        for home_wins, winner, loser in ((True, home, away), (False, away, home)):
+            winners[j] = winner
+            dead[loser] = True
+            scored = partial + bracket.points[j] * (pick == winner)
+            left = settled - future_loss(depth, loser)[active]
+            keep = scored + left >= scored.max() - EPSILON
+            visit(depth + 1, mask | (home_wins << depth), active[keep], scored[keep], left[keep])
+            dead[loser] = False
+        winners[j] = bracket.winners[j]
+
+    visit(0, 0, np.arange(len(base)), base.astype(np.float64), bound)
+    return columns, found
+
+
+def contenders(conference_id):
+    """Return (game ids, contenders) for the rest of a conference tournament.
+
+    game ids are the remaining games in outcome bit order; contenders are
+    sorted by how many outcomes they win, with Contender.user_id holding
+    the user's id.
+    """
+    bracket = load_bracket(conference_id)
+    user_ids, picks = load_picks(bracket, conference_id)
+    if not len(user_ids):
+        return [], []
+    base, _, _ = project(bracket, picks)
+    columns, found = enumerate_outcomes(bracket, picks, base)
+    for user, contender in found.items():
+        contender.user_id = int(user_ids[user])
+    ranked = sorted(found.values(), key=lambda contender: -len(contender.outcomes))
+    return bracket.game_ids[columns].tolist(), ranked
+
+
+def load_contenders(conference_id):
+    """Return the cached contenders() answer for a conference.
+
+    Only one thread per process enumerates a conference at a time; the
+    others wait for its answer.
+    """
+    cached = _contenders.get(conference_id)
+    if cached and cached[0] > time():
+        return cached[1]
+    with _contenders_lock:
+        lock = _conference_locks.setdefault(conference_id, Lock())
+    with lock:
+        cached = _contenders.get(conference_id)
+        if cached and cached[0] > time():
+            return cached[1]
+        generation = _generation[0]
+        answer = contenders(conference_id)
+        with _contenders_lock:
+            if _generation[0] == generation:
+                _contenders[conference_id] = (time() + BRACKET_TTL, answer)
+    return answer
+
+
+def invalidate_contenders(conference_id=None):
+    """Forget one conference's cached contenders, or all of them."""
+    with _contenders_lock:
+        _generation[0] += 1
+        if conference_id is None:
+            _contenders.clear()
+        else:
+            _contenders.pop(conference_id, None)
@@ -7,5 +7,108 @@ manager = Manager(app)
 manager.add_command('db', MigrateCommand)
 
 
+@manager.command
+def rescore(conference_id):
+    """Recompute every bracket score in a conference"""
+    from cbbpoll.models import score_conference
+    score_conference(int(conference_id))
+
+
+@manager.command
+def audit(conference_id):
+    """List brackets whose picks no longer fit the tournament's games"""
+    from time import time
+    from cbbpoll.projections import audit_brackets
+    started = time()
+    checked, problems = audit_brackets(int(conference_id))
+    for user_id, game_ids in problems:
+        print('user %d: games %s' % (user_id, ', '.join(str(game_id) for game_id in game_ids)))
+    print('%d of %d brackets have problems (%.2fs)' % (len(problems), checked, time() - started))
+
+
+@manager.option('--format', choices=['csv', 'ndjson'], default='csv', help='Output format')
+@manager.option('--conference', dest='conference_id', type=int, default=None, help='Only this tournament')
+@manager.option('--output', default=None, help='File to write instead of stdout')
+def export(format, conference_id, output):
+    """Stream every bracket pick with its user's score"""
+    import sys
+    from cbbpoll.export import export_lines
+    out = open(output, 'w') if output else sys.stdout
+    try:
+        for line in export_lines(format, conference_id):
+            out.write(line)
+    finally:
+        if output:
+            out.close()
+
+
+@manager.option('kind', choices=['open', 'close'], help='Which reminder to send')
+@manager.option('conference_id', type=int, help='Tournament to remind users about')
+def remind_email(kind, conference_id):
+    """Email reminders to every user who has opted in"""
+    from time import time
+    from cbbpoll.message import send_reminder_emails
+    from cbbpoll.models import Conference
+    conference = Conference.query.get(conference_id)
+    subject = '%s Tournament Challenge %s' % (conference.name, 'is open' if kind == 'open' else 'closes soon')
+    started = time()
+    count = send_reminder_emails(subject, 'email_remind_' + kind, conference=conference)
+    print('Queued %d emails in %.2fs' % (count, time() - started))
+
+
+@manager.option('kind', choices=['open', 'close'], help='Which reminder to send')
+@manager.option('conference_id', type=int, help='Tournament to remind users about')
+def remind_pm(kind, conference_id):
+    """Queue Reddit PM reminders to every user who has opted in"""
+    from cbbpoll.message import send_reminder_pms
+    from cbbpoll.models import Conference
+    conference = Conference.query.get(conference_id)
+    subject = '%s Tournament Challenge %s' % (conference.name, 'is open' if kind == 'open' else 'closes soon')
+    count = send_reminder_pms(subject, 'pm_remind_' + kind, conference=conference)
+    print('Queued %d PMs' % count)
+
+
+@manager.command
+def pm_status():
+    """Show how many PMs are queued, sent and failed"""
+    from sqlalchemy import func
+    from cbbpoll import db
+    from cbbpoll.models import Job
+    counts = db.session.query(Job.status, func.count()).filter(Job.task == 'send_pm').group_by(Job.status)
+    for status, count in sorted(counts):
+        print('%s: %d' % (status, count))
+
+
+@manager.option('--clients', type=int, default=10, help='Concurrent simulated visitors')
+@manager.option('--duration', type=int, default=30, help='Seconds to run for')
+@manager.option('--users', type=int, default=1000, help='Users to seed')
+@manager.option('--conferences', type=int, default=4, help='Tournaments to seed')
+@manager.option('--seed', dest='seed_value', type=int, default=0, help='Random seed')
+@manager.option('--db', dest='db_path', default=None, help='SQLite file to seed and test against')
+@manager.option('--output', default=None, help='Also write the results here as JSON')
+def loadtest(clients, duration, users, conferences, seed_value, db_path, output):
+    """Replay a mix of traffic against a seeded copy of the app"""
+    import os
+    import sys
+    import tempfile
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks'))
+    from loadtest import main
+    main(clients=clients, duration=duration, users=users, conferences=conferences, seed_value=seed_value,
+         db_path=db_path or os.path.join(tempfile.gettempdir(), 'cbbpoll-loadtest.db'), output=output)
+
+
+@manager.option('--threads', type=int, default=4, help='Jobs to run at once')
+def worker(threads):
+    """Run background jobs until interrupted"""
+    import time
+    from cbbpoll import jobs
+    jobs.start(threads)
+    try:
+        while True:
+            time.sleep(60)
+    except KeyboardInterrupt:
+        jobs.shutdown()
+
+
 if __name__ == '__main__':
     manager.run()
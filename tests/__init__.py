@@ -0,0 +1,39 @@
+"""Tests run against a throwaway SQLite database.
+
+The app reads its settings from a module named config, so one is built here
+from config.sample.py before cbbpoll is imported, with the settings below
+overridden.  A config.py in the working directory is never used.  Jobs
+are queued but not run until a test calls AppTestCase.run_jobs().
+
+Run them from the repository root with:
+
+    python -m unittest discover -s tests -t .
+"""
+import imp
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DB_PATH = os.path.join(tempfile.mkdtemp(prefix='cbbpoll-tests-'), 'test.db')
+
+config = imp.new_module('config')
+execfile(os.path.join(ROOT, 'config.sample.py'), config.__dict__)
+config.__dict__.update(
+    DEBUG=False,
+    TESTING=True,
+    WTF_CSRF_ENABLED=False,
+    SQLALCHEMY_DATABASE_URI='sqlite:///' + DB_PATH,
+    SQLALCHEMY_POOL_RECYCLE=None,
+    SQLALCHEMY_POOL_TIMEOUT=None,
+    LOGFILE=os.path.join(os.path.dirname(DB_PATH), 'test.log'),
+    JOBS_INLINE=False,
+    JOB_WORKERS=0,
+    WHATIF_PROCESSES=1,
+    PAGE_CACHE=None,
+    USER_CACHE_TTL=0,
+    INSTRUMENT=False,
+)
+sys.modules['config'] = config
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
@@ -0,0 +1,109 @@
+import json
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import event
+from cbbpoll import app, db, jobs
+from cbbpoll.models import User, Team, Conference, Game, Job
+from cbbpoll.teamindex import invalidate_team_index
+from cbbpoll.projections import invalidate_bracket
+from cbbpoll.whatif import invalidate_contenders
+
+
+class AppTestCase(unittest.TestCase):
+    """Gives every test empty tables and cold in-process caches."""
+
+    def setUp(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        invalidate_team_index()
+        invalidate_bracket()
+        invalidate_contenders()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+
+    def make_teams(self, count, conference='Big East'):
+        teams = [Team(full_name='University %d' % i, short_name='U%d' % i, flair='team-%d' % i,
+                      nickname='Team %d' % i, png_name='team%d' % i, conference=conference)
+                 for i in range(count)]
+        db.session.add_all(teams)
+        db.session.commit()
+        return [team.id for team in teams]
+
+    def make_users(self, count, team_ids=(), **values):
+        users = [User(nickname='user%d' % i, role='u',
+                      flair=team_ids[i % len(team_ids)] if team_ids else None, **values)
+                 for i in range(count)]
+        db.session.add_all(users)
+        db.session.commit()
+        return [user.id for user in users]
+
+    def make_admin(self):
+        admin = User(nickname='admin', role='a')
+        db.session.add(admin)
+        db.session.commit()
+        return admin.id
+
+    def make_tournament(self, team_ids, name='Tournament'):
+        """Build a single elimination bracket; returns (conference id, game ids by round)."""
+        conference = Conference(name=name, year=2019, status='In Progress')
+        db.session.add(conference)
+        db.session.flush()
+        level = [Game(conference_id=conference.id, point_value=1, home_team_id=home, away_team_id=away,
+                      is_championship=False)
+                 for home, away in zip(team_ids[0::2], team_ids[1::2])]
+        rounds = [level]
+        value = 1
+        while len(level) > 1:
+            value *= 2
+            next_level = [Game(conference_id=conference.id, point_value=value, is_championship=False)
+                          for _ in level[0::2]]
+            db.session.add_all(next_level)
+            db.session.flush()
+            for i, game in enumerate(level):
+                game.next_game_id = next_level[i // 2].id
+                game.winner_is_home = i % 2 == 0
+            db.session.add_all(level)
+            db.session.flush()
+            level = next_level
+            rounds.append(level)
+        level[0].is_championship = True
+        db.session.add_all(rounds[0])
+        db.session.commit()
+        return conference.id, [[game.id for game in games] for games in rounds]
+
+    def login(self, user_id, client=None):
+        with (client or self.client).session_transaction() as session:
+            session['user_id'] = unicode(user_id)
+            session['_fresh'] = True
+
+    @contextmanager
+    def count_queries(self):
+        """Count the statements the engine runs inside the block."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+        event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count)
+
+    def store_job(self, name, *args):
+        now = datetime.utcnow()
+        db.engine.execute(Job.__table__.insert().values(task=name, payload=json.dumps([list(args), {}]),
+                                                        status='pending', attempts=0, run_after=now,
+                                                        created=now, updated=now))
+
+    def run_jobs(self):
+        """Run every queued job that is ready, ignoring backoff."""
+        db.engine.execute(Job.__table__.update().values(run_after=datetime.utcnow()))
+        while True:
+            job = jobs._claim()
+            if job is None:
+                return
+            jobs.run(job)
@@ -0,0 +1,86 @@
+import json
+import unittest
+from cbbpoll import db
+from cbbpoll.models import Game, Job, Prediction
+from cbbpoll.projections import read_bracket, bracket_errors, audit_brackets
+from tests.base import AppTestCase
+
+
+class BracketCheckTest(AppTestCase):
+
+    def setUp(self):
+        super(BracketCheckTest, self).setUp()
+        self.teams = t = self.make_teams(5)
+        self.conference_id, rounds = self.make_tournament(t[:4], 'East')
+        self.games = rounds[0] + rounds[1]
+        self.users = self.make_users(3)
+        # A whole bracket, one that sends a first round loser on, and one left unfinished.
+        self.brackets = [(t[0], t[2], t[2]), (t[0], t[3], t[1]), (t[1], None, None)]
+        db.session.add_all(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id)
+                           for user_id, picks in zip(self.users, self.brackets)
+                           for game_id, team_id in zip(self.games, picks))
+        db.session.commit()
+
+    def errors(self, picks):
+        bracket = read_bracket(self.conference_id)
+        by_game = dict(zip(self.games, picks))
+        return bracket_errors(bracket, [by_game[game_id] or -1 for game_id in bracket.game_ids.tolist()])
+
+    def test_bracket_errors(self):
+        self.assertEqual(self.errors(self.brackets[0]), [])
+        self.assertEqual(self.errors(self.brackets[1]),
+                         ['Team %d can not reach game %d.' % (self.teams[1], self.games[2])])
+        self.assertEqual(sorted(self.errors(self.brackets[2])),
+                         sorted('Game %d has no pick.' % game_id for game_id in self.games[1:]))
+
+    def audit(self):
+        checked, problems = audit_brackets(self.conference_id)
+        return checked, dict((user_id, sorted(game_ids)) for user_id, game_ids in problems)
+
+    def test_audit_finds_every_broken_bracket(self):
+        checked, problems = self.audit()
+        self.assertEqual(checked, 3)
+        self.assertEqual(sorted(problems.items()), [(self.users[1], [self.games[2]]),
+                                            (self.users[2], sorted(self.games[1:]))])
+
+    def test_audit_after_a_game_edit(self):
+        # Team 4 replaces team 2, so the first user's pick of team 2 there is
+        # stranded.  Their final still follows on from that pick.
+        Game.query.get(self.games[1]).home_team_id = self.teams[4]
+        db.session.commit()
+        _, problems = self.audit()
+        self.assertEqual(problems[self.users[0]], [self.games[1]])
+        self.run_jobs()
+        self.assertEqual(set(job.status for job in Job.query.filter_by(task='audit_after_edit')), set(['done']))
+
+    def test_audit_page(self):
+        self.login(self.make_admin())
+        page = self.client.get('/audit/%d' % self.conference_id).data
+        self.assertIn('2 of 3 brackets', page)
+        self.assertIn('user1', page)
+        self.assertNotIn('user0', page)
+
+
+class AuditAfterEditTest(AppTestCase):
+
+    def audits(self):
+        return [json.loads(job.payload)[0] for job in Job.query.filter_by(task='audit_after_edit')]
+
+    def test_one_audit_per_conference_per_commit(self):
+        east, _ = self.make_tournament(self.make_teams(16), 'East')
+        self.assertEqual(self.audits(), [[east]])
+
+    def test_editing_games_in_two_conferences(self):
+        teams = self.make_teams(8)
+        east, east_rounds = self.make_tournament(teams[:4], 'East')
+        west, west_rounds = self.make_tournament(teams[4:], 'West')
+        Job.query.delete()
+        db.session.commit()
+        for game_id in east_rounds[0] + west_rounds[0]:
+            Game.query.get(game_id).point_value = 3
+        db.session.commit()
+        self.assertEqual(sorted(self.audits()), [[east], [west]])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import json
+import unittest
+from sqlalchemy.exc import IntegrityError
+from cbbpoll import db
+from cbbpoll.models import Prediction, Result, Score
+from cbbpoll.projections import load_bracket
+from tests.base import AppTestCase
+
+
+class SubmitBracketTest(AppTestCase):
+
+    def setUp(self):
+        super(SubmitBracketTest, self).setUp()
+        self.teams = self.make_teams(4)
+        self.user = self.make_users(1)[0]
+        self.conference_id, rounds = self.make_tournament(self.teams, 'East')
+        self.games = rounds[0] + rounds[1]
+        self.login(self.user)
+
+    def submit(self, first, second, champion):
+        picks = dict(zip(self.games, (first, second, champion)))
+        return self.client.post('/api/bracket/%d' % self.conference_id, content_type='application/json',
+                                data=json.dumps(dict(picks=picks)))
+
+    def stored_picks(self):
+        return sorted((prediction.game_id, prediction.winning_team_id) for prediction in Prediction.query)
+
+    def test_resubmitting_replaces_the_picks(self):
+        self.assertEqual(self.submit(self.teams[0], self.teams[2], self.teams[0]).status_code, 200)
+        response = self.submit(self.teams[1], self.teams[3], self.teams[3])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.stored_picks(), sorted(zip(self.games, (self.teams[1], self.teams[3], self.teams[3]))))
+        self.assertEqual(Score.query.count(), 1)
+
+    def test_new_bracket_is_on_the_leaderboard(self):
+        other = self.make_users(2)[1]
+        self.assertEqual(self.submit(self.teams[0], self.teams[2], self.teams[0]).status_code, 200)
+        self.login(other)
+        self.assertEqual(self.submit(self.teams[1], self.teams[2], self.teams[1]).status_code, 200)
+        self.assertEqual([(score.user_id, score.rank, score.position)
+                          for score in Score.query.order_by(Score.position)],
+                         [(self.user, 1, 1), (other, 1, 2)])
+        page = self.client.get('/leaderboard/%d/' % self.conference_id).data
+        self.assertIn('user1', page)
+
+    def test_result_from_another_process_locks_the_bracket(self):
+        load_bracket(self.conference_id)
+        # Written behind the session's back, so this process's cache doesn't hear of it.
+        db.engine.execute(Result.__table__.insert().values(game_id=self.games[0], winning_team_id=self.teams[0]))
+        response = self.submit(self.teams[0], self.teams[2], self.teams[0])
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Prediction.query.count(), 0)
+
+    def test_one_prediction_per_user_and_game(self):
+        db.session.add_all([Prediction(user_id=self.user, game_id=self.games[0], winning_team_id=self.teams[0]),
+                            Prediction(user_id=self.user, game_id=self.games[0], winning_team_id=self.teams[1])])
+        self.assertRaises(IntegrityError, db.session.commit)
+        db.session.rollback()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import os
+import shutil
+import tempfile
+import unittest
+from time import time
+from cbbpoll import cache
+from cbbpoll.cache import FileCache, LRUCache, Page
+from tests.base import AppTestCase
+
+
+def page(body='body'):
+    return Page(body, 200, 'text/html', 'etag', None, time() + 60)
+
+
+class FileCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='cbbpoll-pages-')
+        self.store = FileCache(self.directory, max_entries=3, ttl=60)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def age(self, key, seconds):
+        path = self.store._path(key)
+        modified = os.path.getmtime(path) - seconds
+        os.utime(path, (modified, modified))
+
+    def test_keeps_at_most_max_entries(self):
+        for i in range(5):
+            self.store.set('/page/%d' % i, page())
+            self.age('/page/%d' % i, 10 - i)
+        self.store.set('/page/5', page())
+        self.assertEqual(len(os.listdir(self.directory)), 3)
+        self.assertIsNone(self.store.get('/page/0'))
+        self.assertIsNotNone(self.store.get('/page/5'))
+
+    def test_removes_expired_pages(self):
+        self.store.set('/old', page())
+        self.age('/old', 120)
+        self.store.set('/new', page())
+        self.assertIsNone(self.store.get('/old'))
+        self.assertIsNotNone(self.store.get('/new'))
+
+
+class PageKeyTest(AppTestCase):
+
+    def setUp(self):
+        super(PageKeyTest, self).setUp()
+        self.store = cache._store[0] = LRUCache(16)
+
+    def tearDown(self):
+        cache._store[0] = None
+        super(PageKeyTest, self).tearDown()
+
+    def test_query_strings_share_one_entry(self):
+        for query in ('', '?a=1', '?b=2&c=3'):
+            self.assertEqual(self.client.get('/teams' + query).status_code, 200)
+        self.assertEqual(list(self.store._entries), ['/teams'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import csv
+import json
+import unittest
+from cbbpoll import db
+from cbbpoll.export import COLUMNS
+from cbbpoll.models import Prediction, Result, User
+from tests.base import AppTestCase
+
+
+class ExportTest(AppTestCase):
+
+    def setUp(self):
+        super(ExportTest, self).setUp()
+        self.teams = t = self.make_teams(8)
+        self.users = self.make_users(2)
+        User.query.get(self.users[1]).nickname = u'j\xfcrgen'
+        self.east, east_rounds = self.make_tournament(t[:4], 'East')
+        self.west, west_rounds = self.make_tournament(t[4:], 'West')
+        self.east_games = east_rounds[0] + east_rounds[1]
+        self.west_game = west_rounds[0][0]
+        db.session.add_all(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id)
+                           for user_id, picks in zip(self.users, [(t[0], t[2], t[0]), (t[1], t[3], None)])
+                           for game_id, team_id in zip(self.east_games, picks))
+        db.session.add(Prediction(user_id=self.users[0], game_id=self.west_game, winning_team_id=t[4]))
+        db.session.commit()
+        db.session.add(Result(game_id=self.east_games[0], winning_team_id=t[0]))
+        db.session.commit()
+        self.login(self.make_admin())
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.is_streamed)
+        return response
+
+    def test_csv(self):
+        response = self.get('/export/brackets.csv')
+        self.assertEqual(response.mimetype, 'text/csv')
+        rows = list(csv.DictReader(response.data.splitlines()))
+        self.assertEqual(len(rows), 7)
+        self.assertEqual([row['user_id'] for row in rows], [str(self.users[0])] * 4 + [str(self.users[1])] * 3)
+        played = [(row['correct'], row['points']) for row in rows if row['game_id'] == str(self.east_games[0])]
+        self.assertEqual(played, [('True', '1.0'), ('False', '0.0')])
+        self.assertEqual(rows[-1]['nickname'].decode('utf-8'), u'j\xfcrgen')
+        self.assertEqual([row['team'] for row in rows if row['game_id'] == str(self.east_games[2])], ['U0', ''])
+
+    def test_ndjson_for_one_conference(self):
+        response = self.get('/export/brackets.ndjson?conference=%d' % self.east)
+        rows = [json.loads(line) for line in response.data.splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(set(rows[0]), set(COLUMNS))
+        self.assertEqual(set(row['conference_id'] for row in rows), set([self.east]))
+        self.assertEqual([row['correct'] for row in rows if row['game_id'] == self.east_games[0]], [True, False])
+        self.assertEqual(set(row['correct'] for row in rows if row['game_id'] != self.east_games[0]), set([None]))
+
+    def test_admins_only(self):
+        self.login(self.users[0])
+        self.assertEqual(self.client.get('/export/brackets.csv').status_code, 403)
+
+    def test_unknown_format(self):
+        self.assertEqual(self.client.get('/export/brackets.xml').status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+import time
+import unittest
+from cbbpoll import app, botactions
+from cbbpoll.botactions import sync_flair, fetch_flair, update_flair, update_flairs, flair_progress
+from cbbpoll.models import User
+from cbbpoll.teamindex import team_index
+from tests.base import AppTestCase
+
+
+class TeamIndexTest(AppTestCase):
+
+    def test_builds_without_a_request_context(self):
+        team_id = self.make_teams(1)[0]
+        team = team_index().by_id[team_id]
+        with app.test_request_context(base_url='http://example.com/poll/'):
+            self.assertIn("src='/poll/static/img/logos_23.png'", team.logo_html(23))
+
+
+class SyncFlairTest(AppTestCase):
+
+    def test_matches_css_classes_to_teams(self):
+        teams = self.make_teams(2)
+        users = self.make_users(3)
+        flair = {'user0': 'team-1', 'user1': 'not-a-team', 'user2': None}
+
+        def fetch(nickname):
+            return nickname, flair[nickname], True
+        sync_flair([(user_id, 'user%d' % i) for i, user_id in enumerate(users)], fetch=fetch)
+        self.assertEqual([User.query.get(user_id).flair for user_id in users], [teams[1], None, None])
+
+    def test_stopping_early_stops_the_fetches(self):
+        fetched = []
+
+        def fetch(nickname):
+            time.sleep(0.01)
+            fetched.append(nickname)
+            return nickname, None, True
+        results = fetch_flair(['user%d' % i for i in range(100)], fetch=fetch)
+        next(results)
+        results.close()
+        count = len(fetched)
+        time.sleep(0.05)
+        self.assertEqual(len(fetched), count)
+        self.assertLess(count, 100)
+
+
+class FakeRedditor(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class FakeSubreddit(object):
+    """Serves flair from a {nickname: css class} map."""
+
+    def __init__(self, flair):
+        self.flair_by_user = flair
+
+    def flair(self, redditor=None, limit=None):
+        for name, css in sorted(self.flair_by_user.items()):
+            if redditor is None or redditor == name:
+                yield {'user': FakeRedditor(name), 'flair_css_class': css}
+
+
+class FlairJobTest(AppTestCase):
+
+    def setUp(self):
+        super(FlairJobTest, self).setUp()
+        self.teams = self.make_teams(2)
+        self.users = self.make_users(3)
+        subreddit = FakeSubreddit({'user0': 'team-0', 'user1': 'team-1'})
+        self.thread_bot = botactions.thread_bot
+        botactions.thread_bot = lambda: type('FakeReddit', (object,), {'subreddit': lambda self, name: subreddit})()
+
+    def tearDown(self):
+        botactions.thread_bot = self.thread_bot
+        super(FlairJobTest, self).tearDown()
+
+    def flair(self):
+        return [User.query.get(user_id).flair for user_id in self.users]
+
+    def test_login_sync_sets_one_user(self):
+        update_flair(self.users[1], 'user1')
+        self.run_jobs()
+        self.assertEqual(self.flair(), [None, self.teams[1], None])
+        self.assertFalse(flair_progress()['running'])
+
+    def test_bulk_sync_progress_is_kept_on_the_job(self):
+        update_flairs(self.users)
+        self.assertTrue(flair_progress()['running'])
+        self.run_jobs()
+        self.assertEqual(self.flair(), [self.teams[0], self.teams[1], None])
+        progress = flair_progress()
+        self.assertFalse(progress['running'])
+        self.assertEqual((progress['total'], progress['fetched'], progress['failed'], progress['updated']),
+                         (3, 3, 0, 3))
+        self.assertIsNotNone(progress['finished'])
+
+        # A login sync afterwards leaves the bulk sync's numbers alone.
+        update_flair(self.users[2], 'user2')
+        self.run_jobs()
+        self.assertEqual(flair_progress()['fetched'], 3)
+
+    def test_bulk_sync_pages_through_the_flair_list(self):
+        threshold = app.config['FLAIR_LIST_THRESHOLD']
+        app.config['FLAIR_LIST_THRESHOLD'] = 1
+        try:
+            update_flairs(self.users)
+            self.run_jobs()
+        finally:
+            app.config['FLAIR_LIST_THRESHOLD'] = threshold
+        self.assertEqual(self.flair(), [self.teams[0], self.teams[1], None])
+
+
+if __name__ == '__main__':
+    unittest.main()
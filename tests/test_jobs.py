@@ -0,0 +1,182 @@
+import json
+import unittest
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from smtplib import SMTPServerDisconnected
+from praw.exceptions import APIException
+from sqlalchemy import select, func
+from cbbpoll import app, db, jobs, message
+from cbbpoll.models import Job
+from tests.base import AppTestCase
+
+
+class FlakyConnection(object):
+    """Accepts fail_after messages, then drops."""
+
+    def __init__(self, outbox, fail_after):
+        self.outbox = outbox
+        self.fail_after = fail_after
+
+    def send(self, msg):
+        if len(self.outbox) >= self.fail_after:
+            raise SMTPServerDisconnected('Connection unexpectedly closed')
+        self.outbox.append(msg.recipients[0])
+
+
+class EmailBatchTest(AppTestCase):
+
+    def setUp(self):
+        super(EmailBatchTest, self).setUp()
+        self.outbox = []
+        self.fail_after = 3
+        self.connect = message.mail.connect
+        message.mail.connect = self.fake_connect
+
+    def tearDown(self):
+        message.mail.connect = self.connect
+        super(EmailBatchTest, self).tearDown()
+
+    @contextmanager
+    def fake_connect(self):
+        yield FlakyConnection(self.outbox, self.fail_after)
+
+    def test_retry_sends_only_the_rest(self):
+        batch = [['Subject', 'poll@example.com', ['user%d@example.com' % i], 'Body'] for i in range(5)]
+        self.store_job('send_email_batch', batch)
+        self.run_jobs()
+        self.assertEqual(len(self.outbox), 3)
+        job = Job.query.one()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(len(json.loads(job.payload)[0][0]), 2)
+
+        self.fail_after = 5
+        self.run_jobs()
+        self.assertEqual(self.outbox, ['user%d@example.com' % i for i in range(5)])
+        db.session.expire_all()
+        self.assertEqual(Job.query.one().status, 'done')
+
+
+class StaleJobTest(AppTestCase):
+
+    def setUp(self):
+        super(StaleJobTest, self).setUp()
+        jobs._requeued[0] = datetime.min
+
+    def store_running(self, updated):
+        self.store_job('send_pm', 'user0', 'Subject', 'Body')
+        job_id = db.engine.execute(select([func.max(Job.__table__.c.id)])).scalar()
+        db.engine.execute(Job.__table__.update().where(Job.__table__.c.id == job_id)
+                          .values(status='running', attempts=1, updated=updated))
+
+    def statuses(self):
+        db.session.expire_all()
+        return [job.status for job in Job.query.order_by(Job.id)]
+
+    def test_stale_jobs_are_put_back_while_working(self):
+        self.store_running(datetime.utcnow() - jobs.STALE_AFTER - timedelta(minutes=1))
+        self.store_running(datetime.utcnow())
+        jobs._requeue_stale()
+        self.assertEqual(self.statuses(), ['pending', 'running'])
+
+        # A job that goes stale later is found on a later pass.
+        self.store_running(datetime.utcnow() - jobs.STALE_AFTER - timedelta(minutes=1))
+        jobs._requeue_stale()
+        self.assertEqual(self.statuses(), ['pending', 'running', 'running'])
+        jobs._requeued[0] -= timedelta(seconds=jobs.POLL_INTERVAL)
+        jobs._requeue_stale()
+        self.assertEqual(self.statuses(), ['pending', 'running', 'pending'])
+
+
+class FakeReddit(object):
+    """Records PMs, or raises error for every send when it is set."""
+
+    def __init__(self):
+        self.sent = []
+        self.error = None
+
+    def redditor(self, name):
+        return FakeRedditor(self, name)
+
+
+class FakeRedditor(object):
+
+    def __init__(self, reddit, name):
+        self.reddit = reddit
+        self.name = name
+
+    def message(self, subject, body):
+        if self.reddit.error:
+            raise self.reddit.error
+        self.reddit.sent.append(self.name)
+
+
+class PrivateMessageTest(AppTestCase):
+
+    def setUp(self):
+        super(PrivateMessageTest, self).setUp()
+        self.reddit = FakeReddit()
+        self.thread_bot = message.thread_bot
+        message.thread_bot = lambda: self.reddit
+        self.per_minute = app.config['PM_PER_MINUTE']
+
+    def tearDown(self):
+        message.thread_bot = self.thread_bot
+        app.config['PM_PER_MINUTE'] = self.per_minute
+        super(PrivateMessageTest, self).tearDown()
+
+    def statuses(self):
+        db.session.expire_all()
+        return [(job.status, job.attempts) for job in Job.query.filter_by(task='send_pm').order_by(Job.id)]
+
+    def test_sends_at_most_the_limit_a_minute(self):
+        app.config['PM_PER_MINUTE'] = 2
+        message.queue_pms([('user%d' % i, 'Subject', 'Body') for i in range(3)])
+        self.run_jobs()
+        self.assertEqual(self.reddit.sent, ['user0', 'user1'])
+        self.assertEqual(self.statuses(), [('done', 1), ('done', 1), ('pending', 0)])
+
+    def test_rate_limited_pm_is_put_back(self):
+        self.reddit.error = APIException('RATELIMIT', 'you are doing that too much. try again in 5 minutes.', None)
+        message.queue_pms([('user0', 'Subject', 'Body'), ('user1', 'Subject', 'Body')])
+        self.run_jobs()
+        self.assertEqual(self.statuses(), [('pending', 0), ('pending', 0)])
+        self.assertGreater(Job.query.first().run_after, datetime.utcnow() + timedelta(minutes=4))
+
+        # The first PM heads the queue, so the second waits behind it.
+        self.reddit.error = None
+        self.assertIsNone(jobs._claim())
+        self.run_jobs()
+        self.assertEqual(self.reddit.sent, ['user0', 'user1'])
+
+    def test_one_pm_at_a_time(self):
+        message.queue_pms([('user0', 'Subject', 'Body'), ('user1', 'Subject', 'Body')])
+        first = jobs._claim()
+        self.assertEqual(json.loads(first.payload)[0][0], 'user0')
+        # Held back everywhere while the first is running.
+        self.assertIsNone(jobs._claim())
+        jobs.run(first)
+        self.assertEqual(json.loads(jobs._claim().payload)[0][0], 'user1')
+
+    def test_claim_rechecks_running_pm(self):
+        message.queue_pms([('user0', 'Subject', 'Body'), ('user1', 'Subject', 'Body')])
+        # Another process claims the head between this one's read and write.
+        held_back = jobs._held_back
+        def claim_meanwhile(conn, now):
+            names = held_back(conn, now)
+            db.engine.execute(Job.__table__.update().where(Job.__table__.c.id == 1).values(status='running'))
+            return names
+        jobs._held_back = claim_meanwhile
+        try:
+            self.assertIsNone(jobs._claim())
+        finally:
+            jobs._held_back = held_back
+
+    def test_unknown_user_fails_at_once(self):
+        self.reddit.error = APIException('USER_DOESNT_EXIST', "that user doesn't exist", 'to')
+        message.queue_pms([('nobody', 'Subject', 'Body')])
+        self.run_jobs()
+        self.assertEqual(self.statuses(), [('failed', 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import unittest
+from cbbpoll import db, views
+from cbbpoll.models import Prediction, Result, Score, refresh_leaderboard
+from tests.base import AppTestCase
+
+
+class LeaderboardTest(AppTestCase):
+
+    def setUp(self):
+        super(LeaderboardTest, self).setUp()
+        self.teams = t = self.make_teams(4)
+        self.users = self.make_users(4)
+        self.conference_id, rounds = self.make_tournament(self.teams, 'East')
+        self.games = rounds[0] + rounds[1]
+        # user 3 has the final wrong and can't catch up; user 2 left it blank.
+        picks = [(t[0], t[2], t[0]), (t[0], t[3], t[3]), (t[1], t[2], None), (t[1], t[3], t[1])]
+        db.session.add_all(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id)
+                           for user_id, bracket in zip(self.users, picks)
+                           for game_id, team_id in zip(self.games, bracket))
+        db.session.commit()
+        db.session.add_all([Result(game_id=self.games[0], winning_team_id=t[0]),
+                            Result(game_id=self.games[1], winning_team_id=t[2])])
+        db.session.commit()
+
+    def board(self):
+        db.session.expire_all()
+        return dict((score.user_id, (score.points, score.max_remaining, score.rank, score.position))
+                    for score in Score.query.filter_by(conference_id=self.conference_id))
+
+    def test_ranks_ties_and_positions(self):
+        board = self.board()
+        self.assertEqual(board[self.users[0]], (2, 2, 1, 1))
+        self.assertEqual([board[user][:3] for user in self.users[1:]], [(1, 0, 2), (1, 0, 2), (0, 0, 4)])
+        self.assertEqual(sorted(position for _, _, _, position in board.values()), [1, 2, 3, 4])
+
+    def test_refresh_leaves_a_current_board_alone(self):
+        with self.count_queries() as statements:
+            refresh_leaderboard(self.conference_id)
+        self.assertFalse([statement for statement in statements if statement.startswith('UPDATE')], statements)
+
+    def test_final_result_reorders_the_board(self):
+        db.session.add(Result(game_id=self.games[2], winning_team_id=self.teams[0]))
+        db.session.commit()
+        board = self.board()
+        self.assertEqual(board[self.users[0]], (4, 0, 1, 1))
+        self.assertEqual(set(rank for _, _, rank, _ in board.values()), set([1, 2, 4]))
+
+    def test_pages_are_position_ranges(self):
+        page_size = views.LEADERBOARD_PAGE_SIZE
+        views.LEADERBOARD_PAGE_SIZE = 3
+        try:
+            first = self.client.get('/leaderboard/%d/' % self.conference_id)
+            with self.count_queries() as statements:
+                second = self.client.get('/leaderboard/%d/2/' % self.conference_id)
+            missing = self.client.get('/leaderboard/%d/3/' % self.conference_id)
+        finally:
+            views.LEADERBOARD_PAGE_SIZE = page_size
+        self.assertEqual(first.status_code, 200)
+        self.assertIn('Lower &rarr;', first.data)
+        self.assertEqual(first.data.count('<tr class="'), 3)
+        self.assertEqual(second.data.count('<tr class="'), 1)
+        self.assertNotIn('Lower &rarr;', second.data)
+        self.assertTrue(any('score.position BETWEEN' in statement for statement in statements), statements)
+        self.assertEqual(missing.status_code, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import json
+import unittest
+from cbbpoll.teamindex import team_index, invalidate_team_index
+from tests.base import AppTestCase
+
+
+class ListingQueryCountTest(AppTestCase):
+    """Admin listings cost the same few queries however many users there are."""
+
+    def setUp(self):
+        super(ListingQueryCountTest, self).setUp()
+        team_ids = self.make_teams(8)
+        self.make_users(40, team_ids, applicationFlag=True)
+        self.login(self.make_admin())
+
+    def get(self, url):
+        with self.count_queries() as statements:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return response, statements
+
+    def test_users_page(self):
+        # The login lookup and the per-conference counts.
+        _, statements = self.get('/users')
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_whatif_page(self):
+        _, statements = self.get('/whatif')
+        self.assertEqual(len(statements), 2, statements)
+
+    def test_teams_page(self):
+        # The login lookup and the team index.
+        invalidate_team_index()
+        response, statements = self.get('/teams')
+        self.assertEqual(len(statements), 2, statements)
+        self.assertIn('University 7', response.data)
+
+    def test_users_json_page(self):
+        # The login lookup and one page of users with their flair teams.
+        team_index()
+        response, statements = self.get('/_users?conference=Big+East&limit=25')
+        self.assertEqual(len(statements), 2, statements)
+        page = json.loads(response.data)
+        self.assertEqual(len(page['users']), 25)
+        self.assertTrue(all(user['conference'] == 'Big East' for user in page['users']))
+
+        response, statements = self.get('/_users?conference=Big+East&limit=25&after=%d' % page['after'])
+        self.assertEqual(len(statements), 2, statements)
+        self.assertEqual(len(json.loads(response.data)['users']), 15)
+
+
+if __name__ == '__main__':
+    unittest.main()
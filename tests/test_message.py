@@ -0,0 +1,53 @@
+import unittest
+from flask import render_template
+from jinja2 import ChoiceLoader, DictLoader
+from cbbpoll import app
+from cbbpoll.message import CampaignTemplate, prints_fields_only
+from cbbpoll.models import User, Conference
+from tests.base import AppTestCase
+
+TEMPLATES = {
+    'plain.md': 'Dear {{ user.nickname }}, {{ conference.name }} is open.',
+    'tested.md': 'Dear {{ user.nickname }}{% if user.emailConfirmed %}, thanks for confirming{% endif %}.',
+    'filtered.md': 'DEAR {{ user.nickname|upper }}',
+    'converted.md': '{{ user.nickname|string|replace("z", "s") }}',
+    'included.md': '{% include "plain.md" %}',
+}
+
+
+class CampaignTemplateTest(AppTestCase):
+
+    def setUp(self):
+        super(CampaignTemplateTest, self).setUp()
+        self.loader = app.jinja_env.loader
+        app.jinja_env.loader = ChoiceLoader([DictLoader(TEMPLATES), self.loader])
+        self.context = app.test_request_context()
+        self.context.push()
+        self.users = [User(nickname='zed', emailConfirmed=True), User(nickname='amy', emailConfirmed=False)]
+        self.conference = Conference(name='East')
+
+    def tearDown(self):
+        self.context.pop()
+        app.jinja_env.loader = self.loader
+        super(CampaignTemplateTest, self).tearDown()
+
+    def test_shipped_templates_are_rendered_once(self):
+        for template in ('pm_voter_granted.md', 'pm_voter_revoked.md', 'pm_remind_open.md', 'pm_remind_close.md',
+                         'email_remind_open.txt', 'email_remind_close.txt'):
+            self.assertTrue(prints_fields_only(template), template)
+
+    def test_only_bare_fields_are_substituted(self):
+        self.assertTrue(prints_fields_only('plain.md'))
+        for template in ('tested.md', 'filtered.md', 'converted.md', 'included.md'):
+            self.assertFalse(prints_fields_only(template), template)
+
+    def test_every_recipient_gets_the_full_render(self):
+        for template in sorted(TEMPLATES):
+            campaign = CampaignTemplate(template, conference=self.conference)
+            for user in self.users:
+                self.assertEqual(campaign.render(user),
+                                 render_template(template, user=user, conference=self.conference), template)
+
+
+if __name__ == '__main__':
+    unittest.main()
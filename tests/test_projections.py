@@ -0,0 +1,90 @@
+import random
+import unittest
+import numpy as np
+from cbbpoll import db
+from cbbpoll.models import Game, Prediction, Result
+from cbbpoll.projections import read_bracket, load_picks, project
+from tests.base import AppTestCase
+
+
+class ProjectTest(AppTestCase):
+
+    def setUp(self):
+        super(ProjectTest, self).setUp()
+        self.teams = self.make_teams(8)
+        self.conference_id, self.rounds = self.make_tournament(self.teams, 'East')
+
+    def pick(self, user_id, game_id, team_id):
+        db.session.add(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id))
+
+    def result(self, game_id, team_id):
+        db.session.add(Result(game_id=game_id, winning_team_id=team_id))
+
+    def project(self):
+        bracket = read_bracket(self.conference_id)
+        user_ids, picks = load_picks(bracket, self.conference_id)
+        points, remaining, out_of_reach = project(bracket, picks)
+        return dict((user_id, (points[i], remaining[i], bool(out_of_reach[i])))
+                    for i, user_id in enumerate(user_ids.tolist()))
+
+    def test_lost_team_voids_later_picks(self):
+        t = self.teams
+        first, second, final = self.rounds
+        user, other = self.make_users(2)
+        # user rides team 0 all the way; other backs team 1, who loses at once.
+        for game_id in (first[0], second[0], final[0]):
+            self.pick(user, game_id, t[0])
+            self.pick(other, game_id, t[1])
+        self.result(first[0], t[0])
+        db.session.commit()
+        self.assertEqual(self.project(), {user: (1, 2 + 4, False), other: (0, 0, True)})
+
+    def test_missing_picks_earn_nothing(self):
+        user = self.make_users(1)[0]
+        self.pick(user, self.rounds[0][0], self.teams[0])
+        db.session.commit()
+        self.assertEqual(self.project(), {user: (0, 1, False)})
+
+    def test_matches_a_game_by_game_count(self):
+        rng = random.Random(3)
+        users = self.make_users(20)
+        games = Game.query.filter_by(conference_id=self.conference_id).all()
+        for user_id in users:
+            for game in games:
+                self.pick(user_id, game.id, rng.choice(self.teams + [None]))
+        played, losers = {}, set()
+
+        def play(game_id, sides):
+            played[game_id] = rng.choice(sides)
+            losers.update(team for team in sides if team != played[game_id])
+            self.result(game_id, played[game_id])
+        # Three first round games and the second round game two of them feed.
+        first = self.rounds[0]
+        for i in range(3):
+            play(first[i], self.teams[2 * i:2 * i + 2])
+        play(self.rounds[1][0], [played[first[0]], played[first[1]]])
+        db.session.commit()
+
+        expected = {}
+        for user_id in users:
+            points = remaining = 0
+            for prediction in Prediction.query.filter_by(user_id=user_id):
+                value = prediction.game.point_value
+                if prediction.game_id in played:
+                    points += value * (prediction.winning_team_id == played[prediction.game_id])
+                elif prediction.winning_team_id and prediction.winning_team_id not in losers:
+                    remaining += value
+            expected[user_id] = (points, remaining)
+        leader = max(points for points, _ in expected.values())
+        projected = self.project()
+        for user_id, (points, remaining) in expected.items():
+            self.assertEqual(projected[user_id], (points, remaining, points + remaining < leader), user_id)
+
+    def test_no_brackets(self):
+        bracket = read_bracket(self.conference_id)
+        points, remaining, out_of_reach = project(bracket, np.zeros((0, len(bracket)), dtype=np.int64))
+        self.assertEqual((len(points), len(remaining), len(out_of_reach)), (0, 0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
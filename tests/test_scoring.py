@@ -0,0 +1,76 @@
+import unittest
+from cbbpoll import db, models
+from cbbpoll.models import Game, Prediction, Result, Score
+from tests.base import AppTestCase
+
+
+class ResultScoringTest(AppTestCase):
+
+    def setUp(self):
+        super(ResultScoringTest, self).setUp()
+        self.teams = self.make_teams(8)
+        self.users = self.make_users(3)
+        self.east, self.east_rounds = self.make_tournament(self.teams[:4], 'East')
+        self.west, self.west_rounds = self.make_tournament(self.teams[4:], 'West')
+        self.east_game = self.east_rounds[0][0]
+        self.west_game = self.west_rounds[0][0]
+        # user 0 picks the home teams, user 1 the away teams, user 2 leaves the games blank.
+        picks = [(self.users[0], self.east_game, self.teams[0]), (self.users[1], self.east_game, self.teams[1]),
+                 (self.users[2], self.east_game, None),
+                 (self.users[0], self.west_game, self.teams[4]), (self.users[1], self.west_game, self.teams[5]),
+                 (self.users[2], self.west_game, None)]
+        db.session.add_all(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id)
+                           for user_id, game_id, team_id in picks)
+        db.session.commit()
+
+    def points(self, conference_id):
+        return dict((score.user_id, score.points)
+                    for score in Score.query.filter_by(conference_id=conference_id))
+
+    def test_result_without_winner_credits_nobody(self):
+        db.session.add(Result(game_id=self.east_game, winning_team_id=None))
+        db.session.commit()
+        self.assertEqual(sum(self.points(self.east).values()), 0)
+
+    def test_result_credits_correct_picks(self):
+        db.session.add(Result(game_id=self.east_game, winning_team_id=self.teams[0]))
+        db.session.commit()
+        self.assertEqual(self.points(self.east), {self.users[0]: 1, self.users[1]: 0, self.users[2]: 0})
+
+    def test_moving_a_result_rescores_both_conferences(self):
+        result = Result(game_id=self.east_game, winning_team_id=self.teams[0])
+        db.session.add(result)
+        db.session.commit()
+        result.game_id = self.west_game
+        result.winning_team_id = self.teams[5]
+        db.session.commit()
+        self.assertEqual(sum(self.points(self.east).values()), 0)
+        self.assertEqual(self.points(self.west)[self.users[1]], 1)
+        self.assertEqual(self.points(self.west)[self.users[0]], 0)
+
+    def test_repricing_a_game_rescores(self):
+        db.session.add(Result(game_id=self.east_game, winning_team_id=self.teams[0]))
+        db.session.commit()
+        Game.query.get(self.east_game).point_value = 5
+        db.session.commit()
+        self.assertEqual(self.points(self.east)[self.users[0]], 5)
+
+    def test_leaderboard_is_ranked_once_per_commit(self):
+        refreshed = []
+        refresh = models.refresh_leaderboard
+        models.refresh_leaderboard = lambda conference_id: (refreshed.append(conference_id),
+                                                            refresh(conference_id))
+        try:
+            db.session.add_all([Result(game_id=self.east_game, winning_team_id=self.teams[0]),
+                                Result(game_id=self.east_rounds[0][1], winning_team_id=self.teams[2]),
+                                Result(game_id=self.west_game, winning_team_id=self.teams[5])])
+            db.session.commit()
+        finally:
+            models.refresh_leaderboard = refresh
+        self.assertEqual(sorted(refreshed), [self.east, self.west])
+        self.assertEqual(self.points(self.east)[self.users[0]], 1)
+        self.assertEqual(Score.query.filter_by(conference_id=self.east, user_id=self.users[0]).one().rank, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,42 @@
+import re
+import unittest
+from sqlalchemy.exc import OperationalError
+from cbbpoll import app, db, instrument
+from tests.base import AppTestCase
+
+
+class StatsTest(AppTestCase):
+
+    def setUp(self):
+        super(StatsTest, self).setUp()
+        instrument.install()
+        self.admin = self.make_admin()
+
+    def test_server_timing_only_for_admins(self):
+        self.assertNotIn('Server-Timing', self.client.get('/teams').headers)
+        self.login(self.make_users(1)[0])
+        self.assertNotIn('Server-Timing', self.client.get('/teams').headers)
+        self.login(self.admin)
+        self.assertIn('Server-Timing', self.client.get('/teams').headers)
+
+    def test_failed_statement_leaves_no_start_time(self):
+        with db.engine.connect() as conn:
+            self.assertRaises(OperationalError, conn.execute, 'SELECT missing FROM nowhere')
+            conn.execute('SELECT 1')
+            self.assertEqual(conn.info['instrument_started'], [])
+
+    def test_reset_needs_a_csrf_token(self):
+        self.login(self.admin)
+        app.config['WTF_CSRF_ENABLED'] = True
+        try:
+            self.assertEqual(self.client.post('/admin/stats/reset').status_code, 400)
+            page = self.client.get('/admin/stats/').data
+            token = re.search(r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+            response = self.client.post('/admin/stats/reset', data=dict(csrf_token=token))
+            self.assertEqual(response.status_code, 302)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+
+if __name__ == '__main__':
+    unittest.main()
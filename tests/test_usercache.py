@@ -0,0 +1,74 @@
+import unittest
+from cbbpoll import app, db, usercache
+from cbbpoll.models import User, Team, set_voters
+from cbbpoll.usercache import cached_user
+from tests.base import AppTestCase
+
+
+class UserCacheTest(AppTestCase):
+
+    def setUp(self):
+        super(UserCacheTest, self).setUp()
+        self.ttl = app.config['USER_CACHE_TTL']
+        app.config['USER_CACHE_TTL'] = 30
+        usercache._store[0] = None
+        self.team_id = self.make_teams(1)[0]
+        self.user_id = self.make_users(1, [self.team_id])[0]
+        db.session.remove()
+
+    def tearDown(self):
+        app.config['USER_CACHE_TTL'] = self.ttl
+        usercache._store[0] = None
+        super(UserCacheTest, self).tearDown()
+
+    def load(self):
+        """Load the user as a fresh request would, counting statements."""
+        db.session.remove()
+        with self.count_queries() as statements:
+            user = cached_user(self.user_id)
+            flair = user.flair_team.short_name if user and user.flair_team else None
+        return user, flair, statements
+
+    def test_second_load_runs_no_sql(self):
+        _, flair, statements = self.load()
+        self.assertEqual((flair, len(statements)), ('U0', 1))
+        user, flair, statements = self.load()
+        self.assertEqual((user.nickname, flair, statements), ('user0', 'U0', []))
+
+    def test_request_edits_stay_in_the_request(self):
+        user, _, _ = self.load()
+        user.nickname = 'changed'
+        self.assertEqual(self.load()[0].nickname, 'user0')
+
+    def test_committed_user_is_reloaded(self):
+        self.load()
+        User.query.get(self.user_id).nickname = 'renamed'
+        db.session.commit()
+        self.assertEqual(self.load()[0].nickname, 'renamed')
+
+    def test_bulk_update_drops_the_snapshot(self):
+        self.load()
+        with app.test_request_context():
+            set_voters([self.user_id], True)
+        self.assertTrue(self.load()[0].is_voter)
+
+    def test_team_change_drops_every_snapshot(self):
+        self.load()
+        Team.query.get(self.team_id).short_name = 'New'
+        db.session.commit()
+        self.assertEqual(self.load()[1], 'New')
+
+    def test_missing_user(self):
+        db.session.remove()
+        self.assertIsNone(cached_user(self.user_id + 1))
+
+    def test_login_uses_the_cache(self):
+        self.login(self.user_id)
+        self.client.get('/about')
+        with self.count_queries() as statements:
+            self.assertEqual(self.client.get('/about').status_code, 200)
+        self.assertFalse([statement for statement in statements if 'FROM user' in statement], statements)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+import threading
+import unittest
+import urllib
+import urllib2
+from werkzeug.serving import make_server, WSGIRequestHandler
+from cbbpoll import app, db
+from cbbpoll.models import User, Score
+from tests.base import AppTestCase
+
+
+class QuietHandler(WSGIRequestHandler):
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class UserPageTest(AppTestCase):
+
+    def test_ballots_are_the_users_scores(self):
+        teams = self.make_teams(4)
+        users = self.make_users(2)
+        east, _ = self.make_tournament(teams[:2], 'East')
+        west, _ = self.make_tournament(teams[2:], 'West')
+        db.session.add_all([Score(user_id=users[0], conference_id=east),
+                            Score(user_id=users[0], conference_id=west),
+                            Score(user_id=users[1], conference_id=west)])
+        db.session.commit()
+        self.assertEqual([score.conference_id for score in User.query.get(users[0]).ballots], [west, east])
+        self.login(users[0])
+        page = self.client.get('/user/user1/').data
+        self.assertIn('West 2019', page)
+        self.assertNotIn('East 2019', page)
+
+
+class ThreadedUserPageTest(AppTestCase):
+    """Per-user data stays with its user when requests run side by side."""
+
+    USERS = 12
+
+    def setUp(self):
+        super(ThreadedUserPageTest, self).setUp()
+        self.teams = self.make_teams(4)
+        self.users = self.make_users(self.USERS)
+        with app.test_request_context():
+            for user in User.query.filter(User.id.in_(self.users[0::2])):
+                user.is_voter = True
+            db.session.commit()
+        # Half of the users apply while the other half load their own page.
+        self.applicants = set(self.users[:self.USERS // 2])
+        self.server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=QuietHandler)
+        self.server_thread = threading.Thread(target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server_thread.join()
+        self.server.server_close()
+        super(ThreadedUserPageTest, self).tearDown()
+
+    def marker(self, user_id):
+        return 'approach-%03d' % user_id
+
+    def request(self, user_id, path, data=None):
+        cookie = app.session_interface.get_signing_serializer(app).dumps(
+            {'user_id': unicode(user_id), '_fresh': True})
+        request = urllib2.Request('http://127.0.0.1:%d%s' % (self.server.server_port, path),
+                                  urllib.urlencode(data) if data else None)
+        request.add_header('Cookie', '%s=%s' % (app.session_cookie_name, cookie))
+        return urllib2.urlopen(request, timeout=30).read()
+
+    def visit(self, index, user_id, start, errors):
+        try:
+            start.wait()
+            if user_id in self.applicants:
+                # /apply redirects to the applicant's own page.
+                page = self.request(user_id, '/apply', {
+                    'primary_team_id': self.teams[index % len(self.teams)],
+                    'approach': self.marker(user_id),
+                    'will_participate': 'y'})
+            else:
+                page = self.request(user_id, '/user/user%d/' % index)
+            for other in self.users:
+                shown = self.marker(other) in page
+                if shown != (other == user_id and user_id in self.applicants):
+                    errors.append('user%d page %s %s' % (index, 'shows' if shown else 'lacks',
+                                                         self.marker(other)))
+            with app.app_context():
+                user = User.query.get(user_id)
+                events = user.voterEvents.all()
+                if [event.user_id for event in events] != [user_id] * (index % 2 == 0):
+                    errors.append('user%d has voter events %r' % (index, events))
+                applications = user.voterApplication.values()
+                if [application.user_id for application in applications] != [user_id] * (user_id in self.applicants):
+                    errors.append('user%d has applications %r' % (index, applications))
+        except Exception as e:
+            errors.append('user%d: %r' % (index, e))
+
+    def test_concurrent_apply_and_user_pages(self):
+        start = threading.Event()
+        errors = []
+        threads = [threading.Thread(target=self.visit, args=(index, user_id, start, errors))
+                   for index, user_id in enumerate(self.users)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(set(user.id for user in User.query if user.voterApplication), self.applicants)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import unittest
+from datetime import datetime, timedelta
+from cbbpoll import app, db
+from cbbpoll.models import User, Job, VoterEvent, set_voters, VOTER_GRANTED_SUBJECT, VOTER_REVOKED_SUBJECT
+from tests.base import AppTestCase
+
+
+class VoterStatusTest(AppTestCase):
+
+    def setUp(self):
+        super(VoterStatusTest, self).setUp()
+        self.user_id = self.make_users(1, voter=False)[0]
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+        super(VoterStatusTest, self).tearDown()
+
+    def pms(self):
+        return [json.loads(job.payload)[0] for job in Job.query.filter_by(task='send_pm')]
+
+    def test_pm_is_queued_after_commit(self):
+        user = User.query.get(self.user_id)
+        user.is_voter = True
+        db.session.flush()
+        self.assertEqual(self.pms(), [])
+        db.session.commit()
+        self.assertEqual([(recipient, subject) for recipient, subject, _ in self.pms()],
+                         [('user0', VOTER_GRANTED_SUBJECT)])
+        self.assertEqual(VoterEvent.query.count(), 1)
+
+    def test_rolled_back_change_sends_nothing(self):
+        user = User.query.get(self.user_id)
+        user.is_voter = True
+        db.session.rollback()
+        user = User.query.get(self.user_id)
+        user.email = 'user0@example.com'
+        db.session.commit()
+        self.assertEqual(self.pms(), [])
+        self.assertFalse(User.query.get(self.user_id).is_voter)
+
+
+class SetVotersTest(AppTestCase):
+
+    def setUp(self):
+        super(SetVotersTest, self).setUp()
+        self.user_ids = self.make_users(3, voter=False)
+        self.context = app.test_request_context()
+        self.context.push()
+
+    def tearDown(self):
+        self.context.pop()
+        super(SetVotersTest, self).tearDown()
+
+    def pms(self):
+        return [tuple(json.loads(job.payload)[0][:2]) for job in Job.query.filter_by(task='send_pm')]
+
+    def test_only_changed_users_are_told(self):
+        self.assertEqual(set_voters(self.user_ids[:2], True), 2)
+        self.assertEqual(set_voters(self.user_ids, True), 1)
+        self.assertEqual(sorted(self.pms()), [('user%d' % i, VOTER_GRANTED_SUBJECT) for i in range(3)])
+        self.assertEqual(VoterEvent.query.count(), 3)
+
+    def test_unset_status_is_revoked_silently(self):
+        db.engine.execute(User.__table__.update().where(User.__table__.c.id == self.user_ids[0])
+                          .values(voter=None))
+        set_voters(self.user_ids[1:2], True)
+        self.assertEqual(set_voters(self.user_ids, False), 1)
+        self.assertEqual(self.pms(), [('user1', VOTER_GRANTED_SUBJECT), ('user1', VOTER_REVOKED_SUBJECT)])
+        self.assertEqual(User.query.filter(User.voter == None).count(), 0)
+        self.assertEqual([event.user_id for event in VoterEvent.query.order_by(VoterEvent.id)],
+                         [self.user_ids[1]] * 2)
+
+
+class VoterHistoryTest(AppTestCase):
+
+    def setUp(self):
+        super(VoterHistoryTest, self).setUp()
+        self.user_id = self.make_users(1, voter=False)[0]
+        self.start = datetime(2019, 3, 1, 12, 0, 0)
+
+    def record(self, *changes):
+        db.session.add_all(VoterEvent(user_id=self.user_id, timestamp=self.start + timedelta(seconds=offset),
+                                      is_voter=value)
+                           for offset, value in changes)
+        db.session.commit()
+
+    def was_voter(self, seconds):
+        at = self.start + timedelta(seconds=seconds)
+        user = User.query.get(self.user_id)
+        expression = db.session.query(User.was_voter_at(at)).filter(User.id == self.user_id).scalar()
+        self.assertEqual(user.was_voter_at(at), bool(expression))
+        return user.was_voter_at(at)
+
+    def test_latest_event_decides(self):
+        self.record((0, True), (60, False))
+        self.assertFalse(self.was_voter(-1))
+        self.assertTrue(self.was_voter(0))
+        self.assertTrue(self.was_voter(59))
+        self.assertFalse(self.was_voter(60))
+
+    def test_later_event_wins_a_tie(self):
+        self.record((0, True), (0, False), (30, True), (30, False), (30, True))
+        self.assertFalse(self.was_voter(0))
+        self.assertTrue(self.was_voter(30))
+
+    def test_is_voter(self):
+        with app.test_request_context():
+            user = User.query.get(self.user_id)
+            self.assertFalse(user.is_voter)
+            user.is_voter = True
+            db.session.commit()
+            self.assertEqual(User.query.filter(User.is_voter == True).count(), 1)
+            # Setting the same value again records nothing.
+            User.query.get(self.user_id).is_voter = True
+            db.session.commit()
+            self.assertEqual(VoterEvent.query.count(), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import random
+import unittest
+from cbbpoll import app, db, whatif
+from cbbpoll.models import Game, Prediction, Result
+from tests.base import AppTestCase
+
+
+class WhatIfTestCase(AppTestCase):
+
+    def setUp(self):
+        super(WhatIfTestCase, self).setUp()
+        self.teams = self.make_teams(4)
+        self.users = self.make_users(3)
+        conference_id, rounds = self.make_tournament(self.teams, 'East')
+        self.conference_id = conference_id
+        self.games = semifinal, other, final = rounds[0] + rounds[1]
+        picks = [(self.users[0], self.teams[0], self.teams[2], self.teams[0]),
+                 (self.users[1], self.teams[1], self.teams[3], self.teams[3]),
+                 (self.users[2], self.teams[0], self.teams[3], self.teams[3])]
+        db.session.add_all(Prediction(user_id=user_id, game_id=game_id, winning_team_id=team_id)
+                           for user_id, first, second, champion in picks
+                           for game_id, team_id in ((semifinal, first), (other, second), (final, champion)))
+        db.session.commit()
+
+
+class SimulateTest(WhatIfTestCase):
+
+    def test_pool_matches_inline(self):
+        strengths = {self.teams[0]: 3, self.teams[3]: 0.5}
+        inline = whatif.simulate(self.conference_id, strengths, simulations=5000, seed=7)
+        self.assertEqual(len(inline), 3)
+        self.assertIsNone(whatif._pool)
+        # The pool is forked by the first simulation after the setting changes.
+        whatif._pool_pid = None
+        app.config['WHATIF_PROCESSES'] = 2
+        try:
+            pooled = whatif.simulate(self.conference_id, strengths, simulations=5000, seed=7)
+            self.assertEqual(whatif._pool_size, 2)
+        finally:
+            app.config['WHATIF_PROCESSES'] = 1
+            whatif._pool.terminate()
+            whatif._pool = whatif._pool_pid = None
+        self.assertEqual(pooled, inline)
+
+
+class ContendersTest(AppTestCase):
+    """contenders() agrees with scoring every outcome one by one."""
+
+    def setUp(self):
+        super(ContendersTest, self).setUp()
+        rng = random.Random(11)
+        self.teams = self.make_teams(8)
+        self.users = self.make_users(25)
+        self.conference_id, rounds = self.make_tournament(self.teams, 'East')
+        games = Game.query.filter_by(conference_id=self.conference_id).all()
+        db.session.add_all(Prediction(user_id=user_id, game_id=game.id,
+                                      winning_team_id=rng.choice(self.teams + [None]))
+                           for user_id in self.users for game in games)
+        db.session.add(Result(game_id=rounds[0][0], winning_team_id=self.teams[1]))
+        db.session.commit()
+
+    def brute_force(self, order):
+        """Map user id to the outcome masks they finish first in, bit i
+        being set when the home side wins game order[i]."""
+        games = dict((game.id, game) for game in Game.query.filter_by(conference_id=self.conference_id))
+        feeders = dict(((game.next_game_id, game.winner_is_home), game.id) for game in games.values())
+        results = dict((game_id, game.result.winning_team_id) for game_id, game in games.items() if game.result)
+        picks = {}
+        for prediction in Prediction.query:
+            picks.setdefault(prediction.user_id, {})[prediction.game_id] = prediction.winning_team_id
+        wins = {}
+        for mask in range(2 ** len(order)):
+            winners = dict(results)
+            for bit, game_id in enumerate(order):
+                game = games[game_id]
+                home = game.home_team_id or winners[feeders[game_id, True]]
+                away = game.away_team_id or winners[feeders[game_id, False]]
+                winners[game_id] = home if mask >> bit & 1 else away
+            totals = dict((user_id, sum(games[game_id].point_value for game_id, team_id in picked.items()
+                                        if team_id is not None and winners[game_id] == team_id))
+                          for user_id, picked in picks.items())
+            best = max(totals.values())
+            for user_id, total in totals.items():
+                if total == best:
+                    wins.setdefault(user_id, []).append(mask)
+        return wins
+
+    def test_matches_brute_force(self):
+        order, found = whatif.contenders(self.conference_id)
+        self.assertEqual(len(order), 6)
+        expected = self.brute_force(order)
+        self.assertEqual(dict((contender.user_id, sorted(contender.outcomes)) for contender in found), expected)
+        self.assertEqual([len(contender.outcomes) for contender in found],
+                         sorted((len(masks) for masks in expected.values()), reverse=True))
+
+    def test_too_many_games_left(self):
+        maximum = whatif.MAX_ENUMERATED_GAMES
+        whatif.MAX_ENUMERATED_GAMES = 5
+        try:
+            self.assertRaises(ValueError, whatif.contenders, self.conference_id)
+        finally:
+            whatif.MAX_ENUMERATED_GAMES = maximum
+
+
+class ContendersPageTest(WhatIfTestCase):
+
+    def get(self):
+        with self.count_queries() as statements:
+            response = self.client.get('/contenders/%d' % self.conference_id)
+        self.assertEqual(response.status_code, 200)
+        return response.data, statements
+
+    def test_answer_is_cached_until_a_result_arrives(self):
+        page, _ = self.get()
+        self.assertIn(' of 8 ', page)
+        cached_page, statements = self.get()
+        self.assertEqual(cached_page, page)
+        self.assertFalse([statement for statement in statements if 'prediction' in statement], statements)
+
+        db.session.add(Result(game_id=self.games[0], winning_team_id=self.teams[0]))
+        db.session.commit()
+        page, _ = self.get()
+        self.assertIn(' of 4 ', page)
+        self.assertNotIn(' of 8 ', page)
+
+
+if __name__ == '__main__':
+    unittest.main()